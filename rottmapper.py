@@ -35,8 +35,27 @@ class isomapper:
         self.WAD = WAD
         self.wallinfo = walldb.walldb(WAD, level.floor)
         self.spriteinfo = spritedb.spritedb(WAD)
-        self.wallinfo.generate_isometric(level.height)
+        # Only generate the walls actually used in this level. Wall 0 is
+        # also used for anything beyond the edge of the map.
+        self.wallinfo.generate_isometric(level.height, set(level.walls) | {0})
         self.spriteinfo.generate_isometric(level.height)
+
+        # Sprite and view heights for every map cell. Cells are grouped
+        # by wall value, so each tile works out the heights for all of
+        # its cells in one batch.
+        self.spriteheights = [0]*len(level.walls)
+        self.viewheights = [0]*len(level.walls)
+        cells = {}
+        for index, wallval in enumerate(level.walls):
+            cells.setdefault(wallval, []).append(index)
+        for wallval, indices in cells.items():
+            wall = self.wallinfo.tiles[wallval]
+            infovals = [level.info[index] for index in indices]
+            for index, spriteheight, viewheight in zip(indices,
+                    wall.spriteheights(infovals), wall.viewheights(infovals)):
+                self.spriteheights[index] = spriteheight
+                self.viewheights[index] = viewheight
+
         self.mappicture = Image.new("RGBA", (128*64*2, 128*64+level.height), (32, 32, 32))
         self.pen = ImageDraw.Draw(self.mappicture)
         self.minx = self.mappicture.size[0]
@@ -73,8 +92,8 @@ class isomapper:
         """
         return (not adj.issolid(adjinfo) and
             (type(current) != type(adj) or
-                curinfo in walldb.tile.specialheights and
-                adjinfo not in walldb.tile.specialheights))
+                curinfo in walldb.tile.specialheightset and
+                adjinfo not in walldb.tile.specialheightset))
 
     def obscured(self, index, height):
         """ Tests whether a sprite at the given index and height would
@@ -101,7 +120,7 @@ class isomapper:
                 foundsolid = True
             elif not foundsolid and checkwall.isthin(self.level.info[pos]) and count%2 == 1:
                 # Thin walls can obscure, but only if they are directly in line with the sprite
-                rightobscure=max(rightobscure, checkwall.viewheight(self.level.info[pos]) - (count+1)*32)
+                rightobscure=max(rightobscure, self.viewheights[pos] - (count+1)*32)
             elif self.level.info[pos] == 0xd:
                 # Skies will not draw walls adjacent. We need to ighnore the previous solid wall:
                 foundsolid = False
@@ -120,7 +139,7 @@ class isomapper:
             if not foundsolid and checkwall.issolid(self.level.info[pos]):
                 foundsolid = True
             elif not foundsolid and checkwall.isthin(self.level.info[pos]) and count%2 == 1:
-                leftobscure=max(leftobscure, checkwall.viewheight(self.level.info[pos]) - (count+1)*32)
+                leftobscure=max(leftobscure, self.viewheights[pos] - (count+1)*32)
             elif self.level.info[pos] == 0xd:
                 # Skies will not draw walls adjacent. We need to ignore the previous solid wall:
                 foundsolid = False
@@ -169,7 +188,7 @@ class isomapper:
         # ---------------------------------------------------------
         drawn = False
 
-        if type(current) is walldb.floortile and infoval not in walldb.tile.specialheights:
+        if type(current) is walldb.floortile and infoval not in walldb.tile.specialheightset:
             if infoval == 0xd:
                 # Sky processing:
                 pass
@@ -277,10 +296,10 @@ class isomapper:
                 # location
                 self.textspritefont.writetext(self.mappicture, (isox-56, isoy), sprite.text)
                 self.pen.line([(isox,isoy + 16),
-                    (isox, isoy +self.level.height -current.spriteheight(infoval) +32)],
+                    (isox, isoy +self.level.height -self.spriteheights[index] +32)],
                     fill=(0,152,0))
                 self.pen.line([(isox+1,isoy + 16),
-                    (isox+1, isoy +self.level.height -current.spriteheight(infoval) +32)],
+                    (isox+1, isoy +self.level.height -self.spriteheights[index] +32)],
                     fill=(0,108,0))
 
             elif (type(sprite) is spritedb.keysprite or type(sprite) is spritedb.gassprite) \
@@ -299,12 +318,12 @@ class isomapper:
                     sprite.getmask(infoval, index))
 
             # Re-draw obscured important sprites above their obscured location
-            if sprite.important and self.obscured(index, current.spriteheight(infoval)):
+            if sprite.important and self.obscured(index, self.spriteheights[index]):
                 self.pen.line([(isox,isoy),
-                    (isox, isoy +self.level.height -24 -current.spriteheight(infoval))],
+                    (isox, isoy +self.level.height -24 -self.spriteheights[index])],
                     fill=(240,240,240))
                 self.pen.line([(isox+1,isoy),
-                    (isox+1, isoy +self.level.height -24 -current.spriteheight(infoval))],
+                    (isox+1, isoy +self.level.height -24 -self.spriteheights[index])],
                     fill=(190,190,190))
                 self.mappicture.paste(sprite.getimage(infoval, index), (isox-48+sprite.xoffset,
                     isoy -72), sprite.getmask(infoval, index))
@@ -312,10 +331,10 @@ class isomapper:
             # Draw key indicators if needed:
             if type(sprite) is spritedb.keysprite and type(current) is not walldb.thintile:
                 self.pen.line([(isox,isoy),
-                    (isox, isoy +self.level.height -24 -current.spriteheight(infoval))],
+                    (isox, isoy +self.level.height -24 -self.spriteheights[index])],
                     fill=sprite.linecolours[0])
                 self.pen.line([(isox+1,isoy),
-                    (isox+1, isoy +self.level.height -24 -current.spriteheight(infoval))],
+                    (isox+1, isoy +self.level.height -24 -self.spriteheights[index])],
                     fill=sprite.linecolours[1])
                 self.mappicture.paste(sprite.glyph, (isox-8, isoy -32))
 
@@ -336,12 +355,12 @@ class isomapper:
                 xoffs = -len(switchstr)*4
                 yoffs = 16
             self.switchsrcfont.writetext(self.mappicture, (isox+xoffs, isoy+yoffs), switchstr)
-            if current.spriteheight(infoval) < self.level.height - 64:
+            if self.spriteheights[index] < self.level.height - 64:
                 self.pen.line([(isox,isoy + 48),
-                    (isox, isoy +self.level.height -24 -current.spriteheight(infoval))],
+                    (isox, isoy +self.level.height -24 -self.spriteheights[index])],
                     fill=(152,152,0))
                 self.pen.line([(isox+1,isoy + 48),
-                    (isox+1, isoy +self.level.height -24 -current.spriteheight(infoval))],
+                    (isox+1, isoy +self.level.height -24 -self.spriteheights[index])],
                     fill=(108,108,0))
 
         # For index values that look like switch references, print the
@@ -349,12 +368,12 @@ class isomapper:
         elif infoval > 0x100 and infoval < 0x8000:
             switchstr = self.level.switchlookup(infoval)
             self.switchdstfont.writetext(self.mappicture, (isox-len(switchstr)*4, isoy+16), switchstr)
-            if current.spriteheight(infoval) < self.level.height - 64:
+            if self.spriteheights[index] < self.level.height - 64:
                 self.pen.line([(isox,isoy + 48),
-                    (isox, isoy +self.level.height -24 -current.spriteheight(infoval))],
+                    (isox, isoy +self.level.height -24 -self.spriteheights[index])],
                     fill=(0,152,152))
                 self.pen.line([(isox+1,isoy + 48),
-                    (isox+1, isoy +self.level.height -24 -current.spriteheight(infoval))],
+                    (isox+1, isoy +self.level.height -24 -self.spriteheights[index])],
                     fill=(0,108,108))
 
         if current.debugnum > 0:
@@ -17,7 +17,8 @@
 
 """ Module containing a variety of ROTT sprite-type classes, including
 the main sprite database class."""
-import random
+import random, os
+from concurrent.futures import ThreadPoolExecutor
 
 from PIL import Image, ImageDraw
 
@@ -191,15 +192,12 @@ class sprite(object):
                        lower index numbers. The re-colour algorithm
                        needs 11 colours in a range.
         """
-        newimage = image.convert("P") # Use convert to duplicate image
-        pixdata = list(image.getdata())
-
-        for index, pixel in enumerate(pixdata):
-            if pixel in range(158, 169):
-                pixdata[index] = pixel - 168 + colourindex
-
-        newimage.putdata(pixdata)
-        return newimage
+        # Map every palette index to itself, except for the 11 colours
+        # being replaced, and apply that to the whole image in one pass.
+        # point() returns a new image, so the original is left untouched.
+        table = list(range(256))
+        table[158:169] = range(colourindex-10, colourindex+1)
+        return image.point(table)
 
 
 class ceilingsprite(sprite):
@@ -1481,7 +1479,16 @@ class spritedb:
         """ Generates the isometric views for any sprites which contain
         a wall component. Isometric views are generated at the specified
         height.
+
+        Like the wall database, the walls are generated in parallel.
         """
+        walls = {}
         for sprite in self.sprites:
             if type(sprite) is keysprite or type(sprite) is gassprite:
-                sprite.wall.generate_isometric(height)
+                walls[id(sprite.wall)] = sprite.wall
+
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            futures = [executor.submit(wall.generate_isometric, height)
+                for wall in walls.values()]
+            for future in futures:
+                future.result()
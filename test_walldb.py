@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# Tests for the wall database, using a stand-in for a ROTT wad file.
+# Run with: python3 -m unittest test_walldb
+
+import random, unittest
+
+from PIL import Image
+
+import walldb
+
+class fakelump:
+    """ Stand-in for a wad lump, with deterministic random image data """
+    def __init__(self, key, size):
+        rand = random.Random(repr(key))
+        self.data = Image.frombytes("P", size,
+            bytes(rand.randrange(256) for i in range(size[0]*size[1])))
+        self.data.putpalette(bytes(rand.randrange(256) for i in range(768)))
+        self.mask = Image.frombytes("L", size,
+            bytes(rand.choice([0, 128, 255]) for i in range(size[0]*size[1])))
+
+class fakesection:
+    """ Stand-in for a wad section, indexable by lump name or number """
+    def __init__(self, name):
+        self.name = name
+        self.lumps = {}
+
+    def __getitem__(self, key):
+        if key not in self.lumps:
+            size = (128, 128) if self.name == "UPDN" else (64, 64)
+            self.lumps[key] = fakelump((self.name, key), size)
+        return self.lumps[key]
+
+class fakewad:
+    """ Stand-in for wad.WadFile, with both data and db lookups """
+    def __init__(self):
+        self.sections = {}
+        self.data = self
+        self.db = self
+
+    def __getitem__(self, name):
+        if name not in self.sections:
+            self.sections[name] = fakesection(name)
+        return self.sections[name]
+
+class walldbtest(unittest.TestCase):
+    def test_separate_heights(self):
+        """ Two databases for the same WAD and floor keep their own
+        isometric views when generated at different heights.
+        """
+        WAD = fakewad()
+        low = walldb.walldb(WAD, 1)
+        high = walldb.walldb(WAD, 1)
+        low.generate_isometric(64)
+        lowsizes = {i: tile.isowall[0].size for (i, tile) in low.tiles.items()
+            if type(tile) is walldb.walltile}
+        lowface = low.tiles[90].faces[0].tobytes()
+
+        high.generate_isometric(192)
+
+        for (i, size) in lowsizes.items():
+            self.assertEqual(low.tiles[i].isowall[0].size, size)
+            self.assertEqual(high.tiles[i].isowall[0].size, (64, 192+32))
+        self.assertEqual(low.tiles[90].faces[0].size, (64, 64+32))
+        self.assertEqual(low.tiles[90].faces[0].tobytes(), lowface)
+        self.assertEqual(high.tiles[90].faces[0].size, (64, 192+32))
+
+    def test_used_indices(self):
+        """ Tiles left out of a partial generation have no views, even
+        if another database for the same WAD generated them.
+        """
+        WAD = fakewad()
+        walldb.walldb(WAD, 1).generate_isometric(128)
+        partial = walldb.walldb(WAD, 1)
+        partial.generate_isometric(64, {0, 1})
+        self.assertEqual(partial.tiles[1].isowall[0].size, (64, 64+32))
+        self.assertFalse(hasattr(partial.tiles[2], "isowall"))
+    def test_batch_heights(self):
+        """ The batch height methods match the per-value methods for
+        every kind of tile.
+        """
+        db = walldb.walldb(fakewad(), 1)
+        db.generate_isometric(192)
+        infovals = [0, 1, 2, 4, 5, 6, 7, 8, 9, 10, 13, 0xB000, 0xB010,
+            0xB0F5, 0xB0FF, 0xB100, 1, 0]
+        for tile in list(db.tiles.values()) + [db.spacer]:
+            for allowfloat in (True, False):
+                self.assertEqual(tile.spriteheights(infovals, allowfloat),
+                    [tile.spriteheight(infoval, allowfloat)
+                        for infoval in infovals])
+            self.assertEqual(tile.viewheights(infovals),
+                [tile.viewheight(infoval) for infoval in infovals])
+
+if __name__ == "__main__":
+    unittest.main()
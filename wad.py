@@ -23,9 +23,10 @@ Also dumps the complete contents of the wad file to disk if run directly.
 Only tested for DARKWAR.WAD.
 """
 import pdb
-import struct, sys, os.path
+import struct, sys, os.path, mmap, json, hashlib
+from concurrent.futures import ThreadPoolExecutor
 
-from PIL import Image, ImageOps
+from PIL import Image
 
 # Lump types
 (UNLOADED, FLOORCEIL, SKY, WALL, PATCH, PIC, RAW, FONT, LBM) = list(range(9))
@@ -48,7 +49,7 @@ class WadFile:
         #long   numlumps;
         #long   infotableofs;
     #} wadinfo_t;
-    wadheader = '<4sll'
+    wadheader = struct.Struct('<4sll')
 
     def __init__(self, filename):
         """ Initializes the current WAD instance by loading from
@@ -56,10 +57,12 @@ class WadFile:
         not load them yet.
         """
         self.filedata = open(filename, 'rb')
-        (self.wadid, self.numlumps, infotable) = struct.unpack(self.wadheader,
-            self.filedata.read(struct.calcsize(self.wadheader)))
+        # Map the whole file once; lumps read directly out of this buffer
+        self.filebuffer = mmap.mmap(self.filedata.fileno(), 0,
+            access=mmap.ACCESS_READ)
+        (self.wadid, self.numlumps, infotable) = self.wadheader.unpack_from(
+            self.filebuffer)
 
-        self.filedata.seek(infotable)
         self.data = {}
         self.db = {}
         self.palette = None
@@ -67,15 +70,18 @@ class WadFile:
 
         block = 'General'
         for lumpnum in range(self.numlumps):
-            templump = Lump(self.filedata)
+            templump = Lump(self.filebuffer,
+                infotable + lumpnum*Lump.direntry.size)
 
             if templump.size == 0:
-                if templump.name.endswith("STOP"):
+                # Section marker. Test the raw name bytes for the suffix.
+                suffix = templump.rawname[-5:]
+                if suffix[-4:] == b"STOP":
                     block = 'General'
-                elif templump.name.endswith("STRT"):
-                    block = templump.name[:-4]
-                elif templump.name.endswith("START"):
-                    block = templump.name[:-5]
+                elif suffix[-4:] == b"STRT":
+                    block = sys.intern(templump.name[:-4])
+                elif suffix == b"START":
+                    block = sys.intern(templump.name[:-5])
                 else:
                     block = templump.name
             elif templump.name == "PAL":
@@ -88,7 +94,7 @@ class WadFile:
                 self.db[block][templump.name] = templump
 
         if self.palette != None:
-            self.palette.load_raw()
+            self.palette.load_raw(self.filebuffer)
 
 
     def listing(self, listfile):
@@ -113,154 +119,230 @@ class WadFile:
         """ Caches (i.e. read from disk and processes) the important
         images for rendering a map.
         """
+        # The palette is shared by every lump, so fetch the bytes once
+        palette = self.palette.data
+
+        # Gather every lump needed for the bulk sections, along with the
+        # method that loads it
+        loads = []
         for lumptype in ["WALL", "ELEV", "ANIM", "DOOR", "EXIT", "SIDE", "ABVW"]:
             for lump in self.data[lumptype]:
                 if (lump.is_wall()):
-                    lump.load_wall(self.palette.data)
+                    loads.append((lump, lump.load_wall))
                 else:
-                    lump.load_patch(self.palette.data)
+                    loads.append((lump, lump.load_patch))
         for lump in self.data["UPDN"]:
-            lump.load_floorceil(self.palette.data)
+            loads.append((lump, lump.load_floorceil))
         for lumptype in ["SHAP", "MASK", "HMSK", "ABVM"]:
             for lump in self.data[lumptype]:
-                lump.load_patch(self.palette.data)
-        self.db["General"]["NEWFNT1"].load_font(self.palette.data)
-        self.db["General"]["SMALLFON"].load_font(self.palette.data)
-        self.db["General"]["KEY1"].load_pic(self.palette.data)
-        self.db["General"]["KEY2"].load_pic(self.palette.data)
-        self.db["General"]["KEY3"].load_pic(self.palette.data)
-        self.db["General"]["KEY4"].load_pic(self.palette.data)
+                loads.append((lump, lump.load_patch))
+
+        # Load them in the order they appear in the file, so the mapped
+        # file is read from disk front to back rather than jumping
+        # between sections.
+        loads.sort(key=lambda load: load[0].pos)
+
+        # Each lump decodes independently from the shared read-only
+        # buffer, so spread the bulk sections over a pool of threads.
+        # Pillow releases the GIL while it builds and converts images.
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            futures = [executor.submit(load, self.filebuffer, palette)
+                for (lump, load) in loads]
+
+        # Re-raise any error from the worker threads
+        for future in futures:
+            future.result()
+
+        self.db["General"]["NEWFNT1"].load_font(self.filebuffer, palette)
+        self.db["General"]["SMALLFON"].load_font(self.filebuffer, palette)
+        self.db["General"]["KEY1"].load_pic(self.filebuffer, palette)
+        self.db["General"]["KEY2"].load_pic(self.filebuffer, palette)
+        self.db["General"]["KEY3"].load_pic(self.filebuffer, palette)
+        self.db["General"]["KEY4"].load_pic(self.filebuffer, palette)
 
     def loadall(self):
         """ Loads and processes all data from the wad file."""
         self.cacheimages()
+        palette = self.palette.data
 
         # Manually load any entries that need to be loaded specially
         # Note: Order matters! Load palettes first!
-        self.db["PLAYMAPS"]["FINDRPAL"].load_raw()
-        self.db["PLAYMAPS"]["FINFRPAL"].load_raw()
-        self.db["PLAYMAPS"]["NICPAL"].load_raw()
-        self.db["PLAYMAPS"]["BOATPAL"].load_raw() # Not sure what uses this
-        self.db["General"]["AP_PAL"].load_raw()
-
-        self.db["PLAYMAPS"]["FINLDOOR"].load_patch(self.db["PLAYMAPS"]["FINDRPAL"].data)
-        self.db["PLAYMAPS"]["FINLFIRE"].load_patch(self.db["PLAYMAPS"]["FINFRPAL"].data)
-        self.db["PLAYMAPS"]["BUDGCUT"].load_patch(self.db["PLAYMAPS"]["NICPAL"].data)
-        self.db["PLAYMAPS"]["NICOLAS"].load_patch(self.db["PLAYMAPS"]["NICPAL"].data)
-        self.db["PLAYMAPS"]["ONEYEAR"].load_patch(self.db["PLAYMAPS"]["NICPAL"].data)
-        self.db["General"]["AP_TITL"].load_patch(self.db["General"]["AP_PAL"].data)
-        self.db["General"]["AP_WRLD"].load_pic(self.db["General"]["AP_PAL"].data)
-
-        self.db["General"]["TINYFONT"].load_font(self.palette.data)
-        self.db["General"]["ITNYFONT"].load_font(self.palette.data)
-        self.db["General"]["IFNT"].load_font(self.palette.data)
-        self.db["General"]["SIFONT"].load_font(self.palette.data)
-        self.db["General"]["LIFONT"].load_font(self.palette.data)
-        self.db["PLAYMAPS"]["BOOTBLOD"].load_lbm()
-        self.db["PLAYMAPS"]["BOOTNORM"].load_lbm()
-        self.db["PLAYMAPS"]["DEADBOSS"].load_lbm()
-        self.db["PLAYMAPS"]["IMFREE"].load_lbm()
+        self.db["PLAYMAPS"]["FINDRPAL"].load_raw(self.filebuffer)
+        self.db["PLAYMAPS"]["FINFRPAL"].load_raw(self.filebuffer)
+        self.db["PLAYMAPS"]["NICPAL"].load_raw(self.filebuffer)
+        self.db["PLAYMAPS"]["BOATPAL"].load_raw(self.filebuffer) # Not sure what uses this
+        self.db["General"]["AP_PAL"].load_raw(self.filebuffer)
+
+        self.db["PLAYMAPS"]["FINLDOOR"].load_patch(self.filebuffer, self.db["PLAYMAPS"]["FINDRPAL"].data)
+        self.db["PLAYMAPS"]["FINLFIRE"].load_patch(self.filebuffer, self.db["PLAYMAPS"]["FINFRPAL"].data)
+        self.db["PLAYMAPS"]["BUDGCUT"].load_patch(self.filebuffer, self.db["PLAYMAPS"]["NICPAL"].data)
+        self.db["PLAYMAPS"]["NICOLAS"].load_patch(self.filebuffer, self.db["PLAYMAPS"]["NICPAL"].data)
+        self.db["PLAYMAPS"]["ONEYEAR"].load_patch(self.filebuffer, self.db["PLAYMAPS"]["NICPAL"].data)
+        self.db["General"]["AP_TITL"].load_patch(self.filebuffer, self.db["General"]["AP_PAL"].data)
+        self.db["General"]["AP_WRLD"].load_pic(self.filebuffer, self.db["General"]["AP_PAL"].data)
+
+        self.db["General"]["TINYFONT"].load_font(self.filebuffer, palette)
+        self.db["General"]["ITNYFONT"].load_font(self.filebuffer, palette)
+        self.db["General"]["IFNT"].load_font(self.filebuffer, palette)
+        self.db["General"]["SIFONT"].load_font(self.filebuffer, palette)
+        self.db["General"]["LIFONT"].load_font(self.filebuffer, palette)
+        self.db["PLAYMAPS"]["BOOTBLOD"].load_lbm(self.filebuffer)
+        self.db["PLAYMAPS"]["BOOTNORM"].load_lbm(self.filebuffer)
+        self.db["PLAYMAPS"]["DEADBOSS"].load_lbm(self.filebuffer)
+        self.db["PLAYMAPS"]["IMFREE"].load_lbm(self.filebuffer)
 
         # Load the rest of the entries
         for lump in self.data["SKY"]:
-            lump.load_sky(self.palette.data)
+            lump.load_sky(self.filebuffer, palette)
         for lumptype in ["GUN", "General", "ORDR", "PLAYMAPS"]:
             for lump in self.data[lumptype]:
                 if lump.contents == UNLOADED:
-                    lump.load_patch(self.palette.data)
+                    lump.load_patch(self.filebuffer, palette)
                     if lump.contents == UNLOADED:
-                        lump.load_pic(self.palette.data)
+                        lump.load_pic(self.filebuffer, palette)
                     if lump.contents == UNLOADED:
-                        lump.load_raw()
+                        lump.load_raw(self.filebuffer)
         for lumptype in ["DIGI", "SONG", "AD", "SPECMAPS", "PC"]:
             for lump in self.data[lumptype]:
-                lump.load_raw()
+                lump.load_raw(self.filebuffer)
 
     @staticmethod
     def createpath(pathname):
-        """ Simple utility method for creating a path only if it does
-        not already exist.
+        """ Simple utility method for creating a path (and any missing
+        parents) only if it does not already exist.
         """
-        if not os.path.exists(pathname):
-            os.mkdir(pathname)
+        os.makedirs(pathname, exist_ok=True)
 
     def dumpcontents(self, outpath):
         """ Dumps the complete contents of this WAD file to disk in
         the specified folder. Each grouping of the WAD file will be
         written to a separate subfolder. Each entry in that group
         will be indexed by its position in the section.
+
+        A manifest of written files is kept in the output folder. Files
+        whose lump (and WAD file modification time) are unchanged since
+        the last dump are not written again.
         """
         self.createpath(outpath)
 
-        debugfile = open(os.path.join(outpath, 'patchinfo.txt'), 'w')
-        for lumptype in list(self.data.keys()):
-            self.createpath(os.path.join(outpath, lumptype))
-            for index, lump in enumerate(self.data[lumptype]):
-                if (lump.contents == WALL or lump.contents == FLOORCEIL
-                        or lump.contents == SKY or lump.contents == PIC
-                        or lump.contents == LBM):
-
-                    lump.data.save(os.path.join(outpath, lumptype,
-                        "{:04}_{}.png".format(index, lump.name)))
-                elif lump.contents == PATCH:
-                    # Masks need to be recombined with their image for proper transparency on output
-                    compositeimage = Image.new("RGBA", (lump.actwidth, lump.actheight))
-                    compositeimage.paste(lump.data, (0, 0), lump.mask)
-                    compositeimage.save(os.path.join(outpath, lumptype,
-                        "{:04}_{}.png".format(index, lump.name)))
-
-                    # Print debug header information for each image
-                    debugfile.write("{} {} {}x{} {},{}".format(lump.name,
-                        lump.origsize, lump.width, lump.height, lump.leftoffset,
-                        lump.topoffset))
-                    if lump.translevel != None:
-                        debugfile.write(" Trans:{}".format(lump.translevel))
-                    debugfile.write("\n")
-
-                elif lump.contents == RAW:
-                    if lumptype == 'DIGI':
-                        extension = '.VOC'
-                    elif lumptype == 'SONG':
-                        extension = '.MID'
-                    elif lumptype == 'AD':
-                        extension = '.IMF' # Just a guess, can't get to work in AdPlug
-                    elif lump.name in ['SHARTITL', 'SHARTIT2', 'GUSMIDI', 'LICENSE']:
-                        extension = '.TXT'
-                    else:
-                        extension = ''
-
-                    tempfile = open(os.path.join(outpath, lumptype,
-                        "{:04}_{}{}".format(index, lump.name, extension)), 'wb')
-                    tempfile.write(lump.data)
+        manifestname = os.path.join(outpath, 'manifest.json')
+        try:
+            with open(manifestname) as manifestfile:
+                oldmanifest = json.load(manifestfile)
+        except (OSError, ValueError):
+            oldmanifest = {}
+        manifest = {}
+        wadtime = os.path.getmtime(self.filename)
+
+        def needsdump(filename, lump):
+            """ Records an output file for the given lump in the new
+            manifest, returning True if it needs to be written.
+            """
+            key = hashlib.sha1("{}:{}:{}".format(lump.pos, lump.size,
+                wadtime).encode()).hexdigest()
+            manifestkey = os.path.relpath(filename, outpath)
+            manifest[manifestkey] = key
+            return (oldmanifest.get(manifestkey) != key
+                or not os.path.exists(filename))
+
+        # PNG encoding happens on a pool of threads so that it overlaps
+        # with preparing the next image. Debug info is written at the end.
+        saves = []
+        debuglines = []
+        with ThreadPoolExecutor(max_workers=4) as saver:
+            try:
+                for lumptype in list(self.data.keys()):
+                    # Each output folder is joined once per section, not per lump
+                    typepath = os.path.join(outpath, lumptype)
+                    self.createpath(typepath)
+                    for index, lump in enumerate(self.data[lumptype]):
+                        if (lump.contents == WALL or lump.contents == FLOORCEIL
+                                or lump.contents == SKY or lump.contents == PIC
+                                or lump.contents == LBM):
+
+                            filename = os.path.join(typepath,
+                                "{:04}_{}.png".format(index, lump.name))
+                            if needsdump(filename, lump):
+                                saves.append(saver.submit(lump.data.save, filename))
+                        elif lump.contents == PATCH:
+                            filename = os.path.join(typepath,
+                                "{:04}_{}.png".format(index, lump.name))
+                            if needsdump(filename, lump):
+                                # Masks need to be recombined with their image for proper transparency on output
+                                compositeimage = lump.data.convert("RGBA")
+                                compositeimage.putalpha(lump.mask)
+                                saves.append(saver.submit(compositeimage.save, filename))
+
+                            # Print debug header information for each image
+                            debugline = "{} {} {}x{} {},{}".format(lump.name,
+                                lump.origsize, lump.width, lump.height, lump.leftoffset,
+                                lump.topoffset)
+                            if lump.translevel != None:
+                                debugline += " Trans:{}".format(lump.translevel)
+                            debuglines.append(debugline + "\n")
+
+                        elif lump.contents == RAW:
+                            if lumptype == 'DIGI':
+                                extension = '.VOC'
+                            elif lumptype == 'SONG':
+                                extension = '.MID'
+                            elif lumptype == 'AD':
+                                extension = '.IMF' # Just a guess, can't get to work in AdPlug
+                            elif lump.name in ['SHARTITL', 'SHARTIT2', 'GUSMIDI', 'LICENSE']:
+                                extension = '.TXT'
+                            else:
+                                extension = ''
+
+                            filename = os.path.join(typepath,
+                                "{:04}_{}{}".format(index, lump.name, extension))
+                            if needsdump(filename, lump):
+                                tempfile = open(filename, 'wb')
+                                tempfile.write(lump.data)
+                                tempfile.close()
+
+                        elif lump.contents == FONT:
+                            fontpath = os.path.join(typepath,
+                                "{:04}_{}".format(index, lump.name))
+                            self.createpath(fontpath)
+
+                            for index, fontchar in enumerate(lump.data):
+                                filename = os.path.join(fontpath, "{:03}.png".format(index))
+                                if fontchar != None and needsdump(filename, lump):
+                                    # Masks need to be recombined with their image for proper transparency on output
+                                    compositeimage = fontchar.convert("RGBA")
+                                    compositeimage.putalpha(lump.mask[index])
+                                    saves.append(saver.submit(compositeimage.save, filename))
+
+                # Special handling for palette. Generate an image file as well as raw dump:
+                # TODO: do the same for alternate palettes?
+                filename = os.path.join(outpath, "PAL")
+                if needsdump(filename, self.palette):
+                    tempfile = open(filename, 'wb')
+                    tempfile.write(self.palette.data)
                     tempfile.close()
 
-                elif lump.contents == FONT:
-                    fontpath = os.path.join(outpath, lumptype,
-                        "{:04}_{}".format(index, lump.name))
-                    self.createpath(fontpath)
-
-                    for index, fontchar in enumerate(lump.data):
-                        if fontchar != None:
-                            # Masks need to be recombined with their image for proper transparency on output
-                            compositeimage = Image.new("RGBA", fontchar.size)
-                            compositeimage.paste(fontchar, (0, 0), lump.mask[index])
-                            compositeimage.save(os.path.join(fontpath, "{:03}.png".format(index)))
-
-        # Special handling for palette. Generate an image file as well as raw dump:
-        # TODO: do the same for alternate palettes?
-        tempfile = open(os.path.join(outpath, "PAL"), 'wb')
-        tempfile.write(self.palette.data)
-        tempfile.close()
-
-        tempimg = Image.new("P", (16,16))
-        tempimg.putdata(list(range(256)))
-        tempimg.putpalette(self.palette.data)
-        tempimg.save(os.path.join(outpath, "PAL.png"))
+                filename = os.path.join(outpath, "PAL.png")
+                if needsdump(filename, self.palette):
+                    tempimg = Image.frombuffer("P", (16,16), bytes(range(256)),
+                        "raw", "P", 0, 1)
+                    tempimg.putpalette(self.palette.data)
+                    saves.append(saver.submit(tempimg.save, filename))
+            finally:
+                # Wait for all images to be written, re-raising any
+                # errors, even if preparing a later image failed
+                for save in saves:
+                    save.result()
 
+        debugfile = open(os.path.join(outpath, 'patchinfo.txt'), 'w')
+        debugfile.writelines(debuglines)
         debugfile.close()
 
+        with open(manifestname, 'w') as manifestfile:
+            json.dump(manifest, manifestfile, indent=0, sort_keys=True)
+
     def close(self):
         """ Closes the wad file."""
+        self.filebuffer.close()
         self.filedata.close()
 
 class Lump:
@@ -269,6 +351,7 @@ class Lump:
 
     Public member variables:
     name -- the directory listing name for this lump
+    rawname -- the undecoded bytes of the lump name
     size -- the file size of this lump
     contents -- an enumeration (defined at the top of this file)
                 representing what type of data is loaded into this lump.
@@ -284,38 +367,41 @@ class Lump:
         #long       size;
         #char       name[8];
     #} lumpinfo_t;
-    direntry = '<ll8s'
+    direntry = struct.Struct('<ll8s')
 
-    def __init__(self, filedata):
+    def __init__(self, filebuffer, offset):
         """ Initializes the basic information about a lump described
-        at the current position in the file.
+        at the given position in the file.
 
-        filedata -- a file handle open for the wad file. The file handle
-                    needs to be at the position to read a lump header.
+        filebuffer -- a buffer (i.e. memory map) of the whole wad file.
+        offset -- the position in the buffer of the lump header.
         """
-        (self.pos, self.size, tempname) = struct.unpack(self.direntry,
-            filedata.read(struct.calcsize(self.direntry)))
-        self.name = tempname.decode().rstrip('\0')
+        (self.pos, self.size, tempname) = self.direntry.unpack_from(
+            filebuffer, offset)
+        self.rawname = tempname.rstrip(b'\0')
+        # Interned, since names are used as dictionary keys and looked
+        # up with string literals throughout the mappers
+        self.name = sys.intern(self.rawname.decode())
         self.contents = UNLOADED
 
-        # Cache file handle for future reads. Note that this will be invalid
-        # if the WAD file itself is closed.
-        self.filedata = filedata
+    # Note that lumps do not keep a reference to the wad file buffer;
+    # each load_* method is handed the buffer by the owning WadFile,
+    # so loaded lumps remain valid (and picklable) after it is closed.
 
     def is_wall(self):
         """ Tests if this lump is a WALL lump type. """
         return (self.size == 4096 and self.name != 'SDOOR4A')
 
-    def load_wall(self, palette):
+    def load_wall(self, filebuffer, palette):
         """ Loads and decodes a WALL lump, storing the resulting data
         as a PIL Image object.
         """
-        # Note that WALL data is actually stored column-first, but we
-        # can load directly and rotate for simplicity since it is square.
+        # Note that WALL data is actually stored column-first, so we
+        # load it directly and transpose it in a single pass.
         if self.is_wall():
-            self.filedata.seek(self.pos)
-            self.data = ImageOps.mirror(Image.frombytes("P", (64,64),
-                self.filedata.read(self.size)).rotate(-90))
+            self.data = Image.frombytes("P", (64,64),
+                filebuffer[self.pos:self.pos+self.size]).transpose(
+                Image.TRANSPOSE)
             self.data.putpalette(palette)
             self.contents = WALL
 
@@ -325,37 +411,41 @@ class Lump:
        #short     orgx,orgy;
        #byte     data;
     #} lpic_t;
-    floorceil = '<hhhh'
+    floorceil = struct.Struct('<hhhh')
 
-    def load_floorceil(self, palette):
+    def load_floorceil(self, filebuffer, palette):
         """ Loads a floor or ceiling tile lump, storing the resulting
         data as a PIL Image object.
         """
-        self.filedata.seek(self.pos)
-        (width, height, self.orgx, self.orgy) = struct.unpack(self.floorceil,
-            self.filedata.read(struct.calcsize(self.floorceil)))
+        (width, height, self.orgx, self.orgy) = self.floorceil.unpack_from(
+            filebuffer, self.pos)
         self.data = Image.frombytes("P", (width, height),
-            self.filedata.read(self.size-struct.calcsize(self.floorceil)))
+            filebuffer[self.pos+self.floorceil.size:
+                self.pos+self.size])
         self.data.putpalette(palette)
         self.contents = FLOORCEIL
 
-    def load_sky(self, palette):
+    def load_sky(self, filebuffer, palette):
         """ Loads and decodes a SKY lump, storing the resulting data
         as a PIL Image object.
         """
-        # Note that WALL data is actually stored column-first, but we
-        # can load directly and rotate for simplicity since it is square.
-        self.filedata.seek(self.pos)
-        (self.data, temp) = self.load_col_first(256, 200, palette)
+        # Note that SKY data is actually stored column-first, so we
+        # load it directly and transpose it in a single pass.
+        self.data = Image.frombytes("P", (200, 256),
+            filebuffer[self.pos:self.pos+256*200]).transpose(
+            Image.TRANSPOSE)
         self.data.putpalette(palette)
         self.contents = SKY
 
-    def load_col_first(self, width, height, palette, maskcol = -1):
+    def load_col_first(self, filebuffer, offset, width, height, palette,
+            maskcol = -1):
         """ Loads an image of the specified size in a column-first
         arrangement. Since PIL expects a row-first orientation, this
         function is necessary to transpose loaded image data so
         PIL's raw picture mode can interpret it.
 
+        filebuffer -- a buffer (i.e. memory map) of the whole wad file.
+        offset -- the position in the wad file of the image data
         width -- the width of the resulting image
         height -- the height of the resulting image
         palette -- the palette data for the ROTT palette
@@ -365,22 +455,18 @@ class Lump:
         Returns an (image, mask) tuple of the loaded data as PIL Image
         objects.
         """
-        tempdata = [0] * width * height
-        tempmask = [0] * width * height
-        tempread = struct.unpack('<{}B'.format(width * height),
-            self.filedata.read(width * height))
-
-        for y in range(height):
-            for x in range(width):
-                tempdata[y*width + x] = tempread[x*height + y]
-                tempmask[y*width + x] = int(tempread[x*height + y] != maskcol) * 255
+        tempread = filebuffer[offset:offset + width * height]
 
-        tempimg = Image.new("P", (width, height))
+        tempimg = Image.frombuffer("P", (height, width), tempread,
+            "raw", "P", 0, 1).transpose(Image.TRANSPOSE)
         tempimg.putpalette(palette)
-        tempimg.putdata(tempdata)
 
-        tempmaskimg = Image.new("L", (width, height))
-        tempmaskimg.putdata(tempmask)
+        # Everything but the mask colour is opaque
+        masktable = [255] * 256
+        if maskcol >= 0:
+            masktable[maskcol] = 0
+        tempmaskimg = Image.frombuffer("L", (height, width), tempread,
+            "raw", "L", 0, 1).transpose(Image.TRANSPOSE).point(masktable)
 
         return (tempimg, tempmaskimg)
 
@@ -391,7 +477,9 @@ class Lump:
     #   short charofs[256];
     #   byte  data;       // as much as required
     #} font_t;
-    normfont = '<h'
+    normfont = struct.Struct('<h')
+    fontwidths = struct.Struct('<256b')
+    fontoffsets = struct.Struct('<256h')
 
     #typedef struct
     #{
@@ -402,34 +490,35 @@ class Lump:
     #   byte  pal[0x300];
     #   byte  data;       // as much as required
     #} cfont_t;
-    cfont = '<hh'
+    cfont = struct.Struct('<hh')
 
-    def load_font(self, palette = None):
+    def load_font(self, filebuffer, palette = None):
         """ Loads a font lump, storing the resulting
         data as a list of 256 PIL Image objects, one for each
         character in the font.
         """
 
-        self.filedata.seek(self.pos)
         if self.name in ["IFNT", "ITNYFONT", "SIFONT", "LIFONT"]:
-            (self.colour, self.height) = struct.unpack(self.cfont,
-                self.filedata.read(struct.calcsize(self.cfont)))
+            (self.colour, self.height) = self.cfont.unpack_from(
+                filebuffer, self.pos)
+            offset = self.pos + self.cfont.size
         else:
-            (self.height,) = struct.unpack(self.normfont,
-                self.filedata.read(struct.calcsize(self.normfont)))
+            (self.height,) = self.normfont.unpack_from(filebuffer, self.pos)
+            offset = self.pos + self.normfont.size
 
-        self.widths = struct.unpack('<256b', self.filedata.read(256))
-        self.charoffs = struct.unpack('<256h', self.filedata.read(512))
+        self.widths = self.fontwidths.unpack_from(filebuffer, offset)
+        self.charoffs = self.fontoffsets.unpack_from(filebuffer,
+            offset+self.fontwidths.size)
         if self.name in ["IFNT", "ITNYFONT", "SIFONT", "LIFONT"]:
-            self.paldata = self.filedata.read(0x300)
+            self.paldata = filebuffer[offset+768:offset+768+0x300]
             #palette = self.paldata
 
         self.data = [None]*256
         self.mask = [None]*256
         for i in range(256):
             if self.widths[i] > 0:
-                self.filedata.seek(self.pos + self.charoffs[i])
-                (self.data[i], self.mask[i]) = self.load_col_first(self.widths[i], self.height, palette, 0)
+                (self.data[i], self.mask[i]) = self.load_col_first(filebuffer,
+                    self.pos + self.charoffs[i], self.widths[i], self.height, palette, 0)
         self.contents = FONT
 
     #typedef struct
@@ -437,7 +526,7 @@ class Lump:
     #   byte     width,height;
     #   byte     data;
     #} pic_t;
-    smallpic = '<BB'
+    smallpic = struct.Struct('<BB')
 
     #typedef struct
     #{
@@ -445,42 +534,41 @@ class Lump:
     #   short     orgx,orgy;
     #   byte     data;
     #} lpic_t;
-    largepic = '<hhhh'
+    largepic = struct.Struct('<hhhh')
 
-    def load_pic(self, palette):
+    def load_pic(self, filebuffer, palette):
         """ Loads a picture lump, either large or small-type, storing
         the resulting data as a PIL Image object.
         """
 
         # Try large pic first:
-        self.filedata.seek(self.pos)
-        (width, height, orgx, orgy) = struct.unpack(self.largepic,
-            self.filedata.read(struct.calcsize(self.largepic)))
+        (width, height, orgx, orgy) = self.largepic.unpack_from(
+            filebuffer, self.pos)
         if width * height + 8 == self.size:
             self.data = Image.frombytes("P", (height, width),
-                self.filedata.read(self.size-struct.calcsize(self.largepic))).rotate(-90)
+                filebuffer[self.pos+self.largepic.size:
+                    self.pos+self.size]).rotate(-90)
             self.data.putpalette(palette)
             self.contents = PIC
         else:
-            self.filedata.seek(self.pos)
-            (width, height) = struct.unpack(self.smallpic,
-                self.filedata.read(struct.calcsize(self.smallpic)))
+            (width, height) = self.smallpic.unpack_from(
+                filebuffer, self.pos)
             width = width * 4
 
             # Small images seem to have two padding bytes on the end
             if (width * height + 2 <= self.size and self.size <= width * height + 4):
                 # They also appear to be interlaced by 4 somehow
-                tempdata = [0] * width * height
-                tempread = struct.unpack('<{}B'.format(width * height),
-                    self.filedata.read(width * height))
+                tempdata = bytearray(width * height)
+                offset = self.pos + self.smallpic.size
+                tempread = filebuffer[offset:offset + width * height]
                 phasesize = width * height // 4
                 for phase in range(4):
-                    for pos in range(phasesize):
-                        tempdata[pos*4 + phase] = tempread[phasesize * phase + pos]
+                    tempdata[phase::4] = tempread[phasesize * phase:
+                        phasesize * (phase + 1)]
 
-                self.data = Image.new("P", (width, height))
+                self.data = Image.frombuffer("P", (width, height), tempdata,
+                    "raw", "P", 0, 1)
                 self.data.putpalette(palette)
-                self.data.putdata(tempdata)
                 self.contents = PIC
 
     #typedef struct
@@ -492,87 +580,102 @@ class Lump:
        #short          topoffset;        // pixels above the origin
        #unsigned short collumnofs[320];  // only [width] used, the [0] is &collumnofs[width]
     #} patch_t;
-    patch = '<hhhhh'
+    patch = struct.Struct('<hhhhh')
+    patchtrans = struct.Struct('<H')
 
-    def load_patch(self, palette):
+    def load_patch(self, filebuffer, palette):
         """ Loads a patch lump, storing the resulting data as a PIL
         Image object, with another PIL Image for the patch mask.
         """
-        try:
-            # Load patch header
-            self.filedata.seek(self.pos)
-            (self.origsize, self.width, self.height, self.leftoffset,
-                self.topoffset) = struct.unpack(self.patch,
-                self.filedata.read(struct.calcsize(self.patch)))
-
-            if (self.origsize > 320 or self.width > 320
-                or self.height > 320 or self.width > self.origsize
-                or -self.topoffset > self.origsize
-                or -self.leftoffset > self.origsize):
+        # Read the whole lump at once; columns are decoded from it below
+        rawdata = filebuffer[self.pos:self.pos+self.size]
+        if len(rawdata) < self.patch.size + self.patchtrans.size:
+            return
+
+        # Load patch header
+        (self.origsize, self.width, self.height, self.leftoffset,
+            self.topoffset) = self.patch.unpack_from(rawdata)
+
+        if (self.origsize > 320 or self.width > 320
+            or self.height > 320 or self.width > self.origsize
+            or self.width < 0
+            or -self.topoffset > self.origsize
+            or -self.leftoffset > self.origsize):
+
+            return
+
+        # Test for translevel or collumnofs. First columnofs entry
+        # always points to the location just after the collumnofs array:
+        offsetpos = self.patch.size
+        (translevel,) = self.patchtrans.unpack_from(rawdata, offsetpos)
+        if translevel != self.patch.size + self.width*2:
+            self.translevel = translevel
+            offsetpos = offsetpos + self.patchtrans.size
+        else:
+            self.translevel = None
 
-                return
+        if offsetpos + self.width*2 > len(rawdata):
+            return
 
-            # Test for translevel or collumnofs. First columnofs entry
-            # always points to the location just after the collumnofs array:
-            (translevel,) = struct.unpack('<H', self.filedata.read(2))
-            if translevel != struct.calcsize(self.patch) + self.width*2:
-                self.translevel = translevel
-            else:
-                self.translevel = None
-                self.filedata.seek(-2, os.SEEK_CUR)
+        self.actwidth = max(self.width-self.leftoffset, self.origsize)
+        self.actheight = max(self.height-self.topoffset, self.origsize)
 
-            self.actwidth = max(self.width-self.leftoffset, self.origsize)
-            self.actheight = max(self.height-self.topoffset, self.origsize)
+        tempdata = bytearray(self.actwidth * self.actheight)
+        tempmask = bytearray(self.actwidth * self.actheight)
 
-            tempdata = [0]*(self.actwidth * self.actheight)
-            tempmask = [0]*(self.actwidth * self.actheight)
+        self.collumnofs = struct.unpack_from('<{}H'.format(self.width),
+            rawdata, offsetpos)
 
-            self.collumnofs = struct.unpack('<{}H'.format(self.width),
-                self.filedata.read(self.width * 2))
-
-            #if self.name == 'DEADTOM':
-            #    pdb.set_trace()
+        # Load the image column-by-column by working through the colummn offset array
+        for x, offset in enumerate(self.collumnofs):
+            if x == len(self.collumnofs)-1:
+                nextoffset = len(rawdata)
+            else:
+                nextoffset = self.collumnofs[x+1]
+            if nextoffset < offset or nextoffset > len(rawdata):
+                return
 
-            # Load the image column-by-column by working through the colummn offset array
-            for x, offset in enumerate(self.collumnofs):
-                self.filedata.seek(self.pos + offset)
-                if x == len(self.collumnofs)-1:
-                    colsize = self.size - offset
+            # Walk the column in place rather than slicing it out
+            index = offset
+            while (index < nextoffset-1):
+                ystart = rawdata[index]
+                numpix = rawdata[index+1]
+                index = index + 2
+
+                if ystart == 255:
+                    break
+
+                # Each run is a vertical strip, so step through the
+                # row-first image data one row at a time
+                start = (ystart-self.topoffset)*self.actwidth + (x-self.leftoffset)
+                stop = start + numpix*self.actwidth
+
+                # Runs that do not fit in the image mean this is not
+                # actually a patch
+                if numpix > 0 and (start < 0
+                        or stop - self.actwidth >= len(tempdata)):
+                    return
+
+                if self.translevel != None and index < nextoffset \
+                        and rawdata[index] == 254:
+                    # Translucent run. Image data is already zero, so only
+                    # the mask needs filling.
+                    tempmask[start:stop:self.actwidth] = b'\x80' * numpix
+                    index = index + 1
+                elif index + numpix <= nextoffset:
+                    tempdata[start:stop:self.actwidth] = rawdata[index:index+numpix]
+                    tempmask[start:stop:self.actwidth] = b'\xff' * numpix
+                    index = index + numpix
                 else:
-                    colsize = self.collumnofs[x+1] - offset
-                coldata = struct.unpack('<{}B'.format(colsize),
-                    self.filedata.read(colsize))
-
-                index = 0
-                while (index < len(coldata)-1):
-                    ystart = coldata[index]
-                    numpix = coldata[index+1]
-                    index = index + 2
-
-                    if ystart == 255:
-                        break
-                    elif self.translevel != None and coldata[index] == 254:
-                        for y in range(ystart, ystart+numpix):
-                            tempdata[(y-self.topoffset)*self.actwidth + (x-self.leftoffset)] = 0
-                            tempmask[(y-self.topoffset)*self.actwidth + (x-self.leftoffset)] = 128
-                        index = index + 1
-                    else:
-                        for indexoffs, y in enumerate(range(ystart, ystart+numpix)):
-                            tempdata[(y-self.topoffset)*self.actwidth + (x-self.leftoffset)] = coldata[index+indexoffs]
-                            tempmask[(y-self.topoffset)*self.actwidth + (x-self.leftoffset)] = 255
-                        index = index + numpix
-
-
-            self.data = Image.new("P", (self.actwidth, self.actheight))
-            self.data.putpalette(palette)
-            self.data.putdata(tempdata)
+                    return
 
-            self.mask = Image.new("L", (self.actwidth, self.actheight))
-            self.mask.putdata(tempmask)
-            self.contents = PATCH
+        self.data = Image.frombuffer("P", (self.actwidth, self.actheight),
+            tempdata, "raw", "P", 0, 1)
+        self.data.putpalette(palette)
 
-        except:
-            pass
+        self.mask = Image.frombuffer("L", (self.actwidth, self.actheight),
+            tempmask, "raw", "L", 0, 1)
+        self.contents = PATCH
 
     #typedef struct
     #{
@@ -581,59 +684,54 @@ class Lump:
     #   byte palette[768];
     #   byte data;
     #} lbm_t;
-    lbm = '<hh'
+    lbm = struct.Struct('<hh')
 
-    def load_lbm(self):
+    def load_lbm(self, filebuffer):
         """ Loads an LBM-format image (such as the infamous I'm Free
         image), storing the result as a PIL Image object.
         """
-        self.filedata.seek(self.pos)
-        (width, height) = struct.unpack(self.lbm,
-            self.filedata.read(struct.calcsize(self.lbm)))
+        (width, height) = self.lbm.unpack_from(filebuffer, self.pos)
         #if width * height + 8 == self.size:
         # Need good sanity check. Or just manually load LBMs
 
-        paldata = self.filedata.read(768)
-        tempdata = [0]*(width * height)
+        offset = self.pos + self.lbm.size
+        paldata = filebuffer[offset:offset+768]
+        tempdata = bytearray()
 
         # Decode per PackBits compression algorithm
         # http://en.wikipedia.org/wiki/PackBits
-        datasize = self.size - (self.filedata.tell() - self.pos)
-        tempread = struct.unpack('<{}B'.format(datasize),
-            self.filedata.read(datasize))
+        tempread = filebuffer[offset+768:self.pos+self.size]
 
-        index = 0
         pos = 0
-        while pos < len(tempread) and index < (width * height):
+        while pos < len(tempread) and len(tempdata) < (width * height):
             headerbyte = tempread[pos]
             pos = pos + 1
             if headerbyte < 0x80:
                 # N+1 bytes of literal data:
-                for dataoffs in range(headerbyte+1):
-                    tempdata[index+dataoffs] = tempread[pos+dataoffs]
+                tempdata += tempread[pos:pos+headerbyte+1]
                 pos = pos + headerbyte + 1
-                index = index + headerbyte + 1
             elif headerbyte > 0x80 and headerbyte <= 0xFF:
                 # 2's compliment bytes +1 repetition of the following data:
                 repeat = (headerbyte-1 ^ 0xFF) + 1
-                for dataoffs in range(repeat):
-                    tempdata[index+dataoffs] = tempread[pos]
+                tempdata += tempread[pos:pos+1] * repeat
                 pos = pos + 1
-                index = index + repeat
 
-        self.data = Image.new("P", (width, height))
+        # Trim any overrun from the final run and zero-fill a short image
+        del tempdata[width * height:]
+        tempdata += bytes(width * height - len(tempdata))
+
+        self.data = Image.frombuffer("P", (width, height), tempdata,
+            "raw", "P", 0, 1)
         self.data.putpalette(paldata)
-        self.data.putdata(tempdata)
 
         self.contents = LBM
 
 
-    def load_raw(self):
+    def load_raw(self, filebuffer):
         """ Loads the raw contents of a lump, storing the resulting
         data as a byte array.
         """
-        self.filedata.seek(self.pos, 0)
-        self.data = self.filedata.read(self.size)
+        self.data = filebuffer[self.pos:self.pos+self.size]
         self.contents = RAW
 
 
@@ -651,8 +749,7 @@ other data will remain in its original format (e.g. .mid for music,
             wad = WadFile(filename)
 
             outdir = filename + "_output"
-            if not os.path.exists(outdir):
-                os.mkdir(outdir)
+            WadFile.createpath(outdir)
 
             wad.loadall()
             wad.listing(os.path.join(outdir, 'listing.txt'))
@@ -19,12 +19,26 @@
 Also includes the wall database class.
 """
 
-import sys
+import sys, os, copy, weakref, functools
+from concurrent.futures import ThreadPoolExecutor
 
-from PIL import Image, ImageOps, ImageDraw
+from PIL import Image, ImageDraw
 
 import rtl, wad
 
+# Hybrid stack pieces, in the order returned by variabletile.categorizehybrid
+(BOTIMG, BOTSHORT, MIDIMG, MIDEND, TOPIMG, TOPEND) = list(range(6))
+
+# Plain gray image for debug walls. Shared by every wall database; only
+# converted to RGBA if a debug wall is actually generated.
+DEBUGIMAGE = Image.new("L", (64, 64), 128)
+
+# Plain black image, used for both the face and the mask of empty layers
+EMPTYIMAGE = Image.new("L", (64, 64), 0)
+
+# Fully opaque mask, shared by every thin wall layer without a mask
+OPAQUEMASK = Image.new("L", (64, 64), 255)
+
 class tile(object):
     """ Base tile class, which is expanded by all subsequent floor/wall
     tiles. This class has no meaning on its own, but it does define
@@ -37,9 +51,30 @@ class tile(object):
                      tile. Only used for fence tiles, which do not
                      obscure anything behind them. Always -1.
     debugnum -- the wall number for a debug tile. 0 (unused) by default.
+
+    Class member variables:
+    specialheights -- the special height info values, in order.
+    specialheightset -- the same values as a set, for membership tests.
     """
     specialheights = [1]+list(range(4,10))
-    debugnum = 0
+    specialheightset = frozenset(specialheights)
+
+    # Tiles live for the whole run, hundreds per wall database, so the
+    # tile classes use slots instead of a dictionary per instance.
+    # Subclasses list only the member variables they add.
+    __slots__ = ("sourceimages", "convertedimages", "imagecategories",
+        "viewheightovr", "isocache", "height", "debugnum")
+
+    # Bitmask of the special height info values, which are all below 64.
+    # Testing a bit is cheaper than searching the list for every map cell.
+    specialmask = sum([1 << i for i in specialheights])
+
+    @staticmethod
+    def isspecial(infoval):
+        """ Checks if the given info value is one of the special height
+        values (see specialheights).
+        """
+        return infoval < 64 and (tile.specialmask >> infoval) & 1 == 1
 
     """ Base tile class"""
     def __init__(self, images):
@@ -48,12 +83,51 @@ class tile(object):
         images -- a list of images to be used by this tile. Specific use
                   depends on subclass.
         """
-        if images != None:
-            self.images = [image.convert("RGBA") for image in images]
-        else:
-            self.images = None
+        # Source images are only converted to RGBA when first needed
+        self.sourceimages = images
+        self.convertedimages = None
+        self.imagecategories = None
 
         self.viewheightovr = -1
+        self.debugnum = 0
+
+        # Isometric views already generated, keyed by height. Shallow
+        # copies of a tile (i.e. the debug walls) share these views.
+        self.isocache = {}
+
+    @property
+    def images(self):
+        """ The images used by this tile, converted to RGBA on first
+        access. None if this tile has no images.
+        """
+        if self.convertedimages == None and self.sourceimages != None:
+            self.convertedimages = [self.convertimage(image)
+                for image in self.sourceimages]
+        return self.convertedimages
+
+    @property
+    def categories(self):
+        """ The images used by this tile, sorted as per categorizeimages.
+        """
+        if self.imagecategories == None:
+            self.imagecategories = self.categorizeimages(self.images)
+        return self.imagecategories
+
+    # RGBA conversions of source images, keyed by the id of the source.
+    # Entries are dropped as soon as the source image is freed.
+    rgbaimages = {}
+
+    @staticmethod
+    def convertimage(image):
+        """ Converts an image to RGBA for use in a tile. WAD images are
+        used by many tiles, so each is only converted once and the same
+        (read-only) RGBA image is shared between tiles.
+        """
+        key = id(image)
+        if key not in tile.rgbaimages:
+            tile.rgbaimages[key] = image.convert("RGBA")
+            weakref.finalize(image, tile.rgbaimages.pop, key, None)
+        return tile.rgbaimages[key]
 
     @staticmethod
     def categorizeimages(images):
@@ -83,42 +157,105 @@ class tile(object):
         return (botimg, midimg, topimg)
 
     @staticmethod
-    def leftskew(image):
+    def stackimages(images, mode, height):
+        """ Stacks a list of 64x64 images top to bottom into a single
+        image of the given mode and height, in one pass over the raw
+        image data. None entries, as well as any space left over below
+        the stack, are left blank.
+
+        Stacks usually repeat the same few images, so the raw data of
+        each distinct image is only read once and then reused.
+        """
+        rowsize = 64*64*Image.getmodebands(mode)
+        rawdata = {id(None): bytes(rowsize)}
+        for image in images:
+            if id(image) in rawdata:
+                continue
+            if image.mode != mode:
+                rawdata[id(image)] = image.convert(mode).tobytes()
+            else:
+                rawdata[id(image)] = image.tobytes()
+
+        return Image.frombytes(mode, (64, height),
+            b''.join([rawdata[id(image)] for image in images]).ljust(
+                rowsize*height//64, b'\0'))
+
+    # Affine transforms for the isometric wall skews, for 64 pixel wide images
+    leftaffine = (1, 0, 0, -0.5, 1, 0)
+    rightaffine = (1, 0, 0, 0.5, 1, -32)
+    # Right skew of the horizontally mirrored image
+    mirroraffine = (-1, 0, 64, 0.5, 1, -32)
+
+    @staticmethod
+    def leftskew(image, resample=Image.BICUBIC):
         """ Skews the image to the left for isometric walls.
         For UP and DOWN (i.e. y axis) directions.
+
+        resample -- the PIL resampling filter to use. Masks, which are
+                    essentially stencils, can use Image.NEAREST instead.
         """
-        return image.transform((image.size[0],int(image.size[1]+image.size[0]//2)),
-            Image.AFFINE, (1, 0, 0, -0.5, 1, 0), Image.BICUBIC)
+        return image.transform((64, image.size[1]+32),
+            Image.AFFINE, tile.leftaffine, resample)
 
     @staticmethod
-    def rightskew(image):
+    def rightskew(image, resample=Image.BICUBIC):
         """ Skews the image to the right for isometric wals.
         For LEFT and RIGHT (i.e. x axis) directions.
+
+        resample -- the PIL resampling filter to use. Masks, which are
+                    essentially stencils, can use Image.NEAREST instead.
         """
-        return image.transform((image.size[0],int(image.size[1]+image.size[0]//2)),
-            Image.AFFINE, (1, 0, 0, 0.5, 1, -image.size[0]//2), Image.BICUBIC)
+        return image.transform((64, image.size[1]+32),
+            Image.AFFINE, tile.rightaffine, resample)
+
+    @staticmethod
+    def mirrorskew(image, resample=Image.BICUBIC):
+        """ Mirrors the image horizontally and skews it to the right,
+        in a single transform. Used for thin walls facing in the x axis
+        directions.
+
+        resample -- the PIL resampling filter to use, as for rightskew.
+        """
+        return image.transform((64, image.size[1]+32),
+            Image.AFFINE, tile.mirroraffine, resample)
+
+    # Floor skew: a 45 degree rotation and 2x scale up to 128x128,
+    # followed by halving the height. Both steps are combined into one
+    # transform; the 0.25 offsets keep sampling on the same pixel
+    # centres as the original two-step version.
+    flooraffine = (0.5, 1, -31.75, -0.5, 1, 32.25)
 
     @staticmethod
     def floorskew(image):
         """ Skews an image to display on the floor """
-        return image.transform((128,128), Image.AFFINE,
-            (0.5, 0.5, -32, -0.5, 0.5, 32), Image.NEAREST).transform(
-            (128,64), Image.AFFINE, (1, 0, 0, 0, 2, 0), Image.NEAREST)
+        return image.transform((128,64), Image.AFFINE, tile.flooraffine,
+            Image.NEAREST)
+
+    # Isometric floor tiles, keyed by the id of the base floor image.
+    # Entries are dropped as soon as the base image is freed.
+    isofloors = {}
 
     @staticmethod
     def floortrans(image):
         """ Transforms a base floor image into 4 tiles in isometric
-        perspective, ready to place.
+        perspective, ready to place. The floor does not depend on the
+        map height, and every floor and thin wall tile in a level uses
+        the same base image, so each base image is only transformed
+        once and the (read-only) result is shared.
 
         Return order is: (upper left, upper right, lower left, lower right)
         """
-        ul = image.crop((0, 0, 64, 64))
-        ur = image.crop((64, 0, 128, 64))
-        ll = image.crop((0, 64, 64, 128))
-        lr = image.crop((64, 64, 128, 128))
-
-        return (tile.floorskew(ul), tile.floorskew(ur),
-            tile.floorskew(ll), tile.floorskew(lr))
+        key = id(image)
+        if key not in tile.isofloors:
+            ul = image.crop((0, 0, 64, 64))
+            ur = image.crop((64, 0, 128, 64))
+            ll = image.crop((0, 64, 64, 128))
+            lr = image.crop((64, 64, 128, 128))
+
+            tile.isofloors[key] = (tile.floorskew(ul), tile.floorskew(ur),
+                tile.floorskew(ll), tile.floorskew(lr))
+            weakref.finalize(image, tile.isofloors.pop, key, None)
+        return tile.isofloors[key]
 
     def generate_isometric(self, height):
         """ Generates isometric views for this tile. Does nothing for
@@ -143,7 +280,7 @@ class tile(object):
         given info value. False by default, but special height info
         values will create a spacer wall which is considered thin.
         """
-        return infoval in self.specialheights
+        return self.isspecial(infoval)
 
     def spriteheight(self, infoval, allowfloat=True):
         """ Checks the height of a sprite placed at this tile with
@@ -160,7 +297,7 @@ class tile(object):
                       allowed to float in the air.
         """
         # Special hybrid walls and spacers for floors
-        if infoval in self.specialheights:
+        if self.isspecial(infoval):
             if infoval == 9 or infoval == 1:
                 return self.height - 64
             elif infoval == 5 or infoval == 6:
@@ -187,7 +324,7 @@ class tile(object):
         """
         if self.viewheightovr > 0:
             return self.viewheightovr
-        elif infoval in self.specialheights:
+        elif self.isspecial(infoval):
             if infoval == 8 or infoval == 9 or infoval == 1:
                 return self.height - 64
             elif infoval == 5:
@@ -199,9 +336,30 @@ class tile(object):
         else:
             return 0
 
+    def spriteheights(self, infovals, allowfloat=True):
+        """ Batch version of spriteheight, returning a list of sprite
+        heights for a whole sequence of info values (i.e. an entire
+        info layer). Since info layers contain few distinct values, each
+        distinct value is only evaluated once.
+        """
+        heights = {}
+        for infoval in set(infovals):
+            heights[infoval] = self.spriteheight(infoval, allowfloat)
+        return [heights[infoval] for infoval in infovals]
+
+    def viewheights(self, infovals):
+        """ Batch version of viewheight, returning a list of view heights
+        for a whole sequence of info values. Each distinct value is only
+        evaluated once.
+        """
+        heights = {}
+        for infoval in set(infovals):
+            heights[infoval] = self.viewheight(infoval)
+        return [heights[infoval] for infoval in infovals]
+
 class emptytile(tile):
     """ Empty tile subclass to mark a blank spot on the map."""
-    pass
+    __slots__ = ()
 
 class walltile(tile):
     """ Standard wall tile type to mark a solid wall on the map.
@@ -217,45 +375,83 @@ class walltile(tile):
     isomask -- a list of isometric mask images, indexed by directional
                facing and adjusted to the map height.
     """
+    __slots__ = ("isowall", "isomask")
+
+    # Lookup table to darken the back walls, equivalent to a 50% composite
+    # with opaque black (which also raises the alpha band).
+    darkentable = ([round(v*128/255) for v in range(256)]*3
+        + [127 + round(v*128/255) for v in range(256)])
+
+    # Darkened images, keyed by the id of the original (RGBA) image.
+    # Entries are dropped as soon as the original image is freed.
+    darkimages = {}
+
+    @staticmethod
+    def darkenimage(image):
+        """ Darkens a 64x64 image for use in the back walls. This does
+        not depend on the map height, and many walls share the same
+        images, so each image is only darkened once and the (read-only)
+        result is shared.
+        """
+        key = id(image)
+        if key not in walltile.darkimages:
+            walltile.darkimages[key] = image.point(walltile.darkentable)
+            weakref.finalize(image, walltile.darkimages.pop, key, None)
+        return walltile.darkimages[key]
+
+    # Skewed back wall masks, keyed by height. These are identical for
+    # every wall, so they are only generated once.
+    backmasks = {}
+
     def generate_isometric(self, height):
         """ Generates isometric views for this tile at the specified
         map height. Creates skewed wall images facing in each direction,
         populating the isowall and isomask member variables.
         """
         self.height = height
+        if height in self.isocache:
+            (self.isowall, self.isomask) = self.isocache[height]
+            return
+
         self.isowall = [None]*4
         self.isomask = [None]*4
 
         if self.images != None:
-            fullimage = Image.new("RGBA", (64, height))
-
-            (botimg, midimg, topimg) = self.categorizeimages(self.images)
+            (botimg, midimg, topimg) = self.categories
 
             numtiles = height//64
-            for pos in range(numtiles):
-                if pos==0 and numtiles > 1:
-                    fullimage.paste(topimg, (0, pos*64))
-                elif pos == numtiles - 1:
-                    fullimage.paste(botimg, (0, pos*64))
-                else:
-                    fullimage.paste(midimg, (0, pos*64))
+            if numtiles > 1:
+                column = [topimg] + [midimg]*(numtiles-2) + [botimg]
+            else:
+                column = [botimg]*numtiles
+            fullimage = self.stackimages(column, "RGBA", height)
 
-            # Darken the original image for the back walls (make 50% composite with black)
-            backimage = Image.composite(fullimage,
-                Image.new("RGBA", (64, height), (0,0,0)),
-                Image.new("L", (64, height), (128)))
+            # Darken the original images for the back walls, then stack
+            # them as above.
+            backimage = self.stackimages(
+                [self.darkenimage(image) for image in column], "RGBA", height)
 
             # Make back walls 62.5% transparent
-            backmask = Image.new("L", (64, height), (96))
-
+            if height not in walltile.backmasks:
+                backmask = Image.new("L", (64, height), (96))
+                walltile.backmasks[height] = (
+                    self.rightskew(backmask, Image.NEAREST),
+                    self.leftskew(backmask, Image.NEAREST))
+
+            # Front walls are their own mask, so the same skewed image
+            # is used for both
             self.isowall[rtl.RIGHT] = self.rightskew(fullimage)
             self.isowall[rtl.DOWN]  = self.leftskew(fullimage)
             self.isowall[rtl.LEFT]  = self.rightskew(backimage)
             self.isowall[rtl.UP]    = self.leftskew(backimage)
-            self.isomask[rtl.RIGHT] = self.rightskew(fullimage)
-            self.isomask[rtl.DOWN]  = self.leftskew(fullimage)
-            self.isomask[rtl.LEFT]  = self.rightskew(backmask)
-            self.isomask[rtl.UP]    = self.leftskew(backmask)
+            self.isomask[rtl.RIGHT] = self.isowall[rtl.RIGHT]
+            self.isomask[rtl.DOWN]  = self.isowall[rtl.DOWN]
+            (self.isomask[rtl.LEFT], self.isomask[rtl.UP]) = \
+                walltile.backmasks[height]
+
+        # Only the most recent height is kept around
+        self.isocache.clear()
+        self.isocache[height] = (self.isowall, self.isomask)
 
     def issolid(self, infoval):
         """ Checks if this tile type is a solid wall according to the
@@ -295,8 +491,16 @@ class thintile(walltile):
              image.
     masks -- a list of two masks for the face images.
     """
+    __slots__ = ("sourcefaces", "convertedfaces", "facemasks",
+        "maskcategories", "floorimage", "faces", "masks", "floor")
+
+    # Skewed masks for thin walls with fully opaque masks (i.e. doors),
+    # keyed by height. These only depend on the height, so they are
+    # generated once and shared by every such wall.
+    opaquemasks = {}
+
     def __init__(self, faceimages, facemasks, sideimages,
-            floorimage=None, viewheightoverride=-1):
+            floorimage=None, viewheightoverride=-1, sharedwalls=None):
         """ Initializes according to the following information:
 
         faceimages -- a list of images to use for the thin tile face
@@ -311,25 +515,60 @@ class thintile(walltile):
         viewheightoverride -- if >=0, this overrides the view height
                      for this tile. Only used for fence tiles, which
                      do not obscure anything behind them
+        sharedwalls -- an existing tile with the same side images. If
+                     given, its side images and isometric wall views
+                     are shared with this tile instead of being
+                     generated again, and sideimages is ignored.
 
         """
-        super(thintile, self).__init__(sideimages)
-        if faceimages != None:
-            self.faceimages = [image.convert("RGBA") for image in faceimages]
+        if sharedwalls != None:
+            super(thintile, self).__init__(sharedwalls.sourceimages)
+            self.isocache = sharedwalls.isocache
+        else:
+            super(thintile, self).__init__(sideimages)
+        # Face and floor images are only converted to RGBA when first
+        # needed, so tiles that a level never uses never hold RGBA copies
+        self.sourcefaces = faceimages
+        self.convertedfaces = None
+
+        # Masks that are fully transparent are dropped (stacked as blank
+        # space), and fully opaque masks are replaced by the shared
+        # opaque mask, so neither needs its own pixel data.
         self.facemasks = []
         for mask in facemasks:
             if mask == None:
-                self.facemasks.append(Image.new("L", (64, 64), 255))
+                self.facemasks.append(OPAQUEMASK)
+                continue
+            (low, high) = mask.getextrema()
+            if high == 0:
+                self.facemasks.append(None)
+            elif low == 255:
+                self.facemasks.append(OPAQUEMASK)
             else:
                 self.facemasks.append(mask)
+        self.maskcategories = self.categorizeimages(self.facemasks)
 
-        if floorimage != None:
-            self.floorimage = floorimage.convert("RGBA")
-        else:
-            self.floorimage = None
+        self.floorimage = floorimage
 
         self.viewheightovr = viewheightoverride
 
+    @property
+    def faceimages(self):
+        """ The face images for this tile, converted to RGBA on first
+        access. None if this tile has no face images.
+        """
+        if self.convertedfaces == None and self.sourcefaces != None:
+            self.convertedfaces = [self.convertimage(image)
+                for image in self.sourcefaces]
+        return self.convertedfaces
+
+    @property
+    def facecategories(self):
+        """ The face images for this tile, sorted as per
+        categorizeimages.
+        """
+        return self.categorizeimages(self.faceimages)
+
     def generate_isometric(self, height):
         """ Generates isometric views for this tile at the specified
         map height. Creates skewed wall images facing in each direction,
@@ -342,31 +581,38 @@ class thintile(walltile):
         self.faces = [None]*2
         self.masks = [None]*2
 
-        fullimage = Image.new("RGBA", (64, height))
-        fullmask = Image.new("L", (64, height))
-
-        (botface, midface, topface) = self.categorizeimages(self.faceimages)
-        (botmask, midmask, topmask) = self.categorizeimages(self.facemasks)
+        (botface, midface, topface) = self.facecategories
+        (botmask, midmask, topmask) = self.maskcategories
 
         numtiles = height//64
-        for pos in range(numtiles):
-            if pos==0 and numtiles > 1:
-                fullimage.paste(topface, (0, pos*64))
-                fullmask.paste(topmask, (0, pos*64))
-            elif pos == numtiles - 1:
-                fullimage.paste(botface, (0, pos*64))
-                fullmask.paste(botmask, (0, pos*64))
-            else:
-                fullimage.paste(midface, (0, pos*64))
-                fullmask.paste(midmask, (0, pos*64))
+        if numtiles > 1:
+            fullimage = self.stackimages(
+                [topface] + [midface]*(numtiles-2) + [botface], "RGBA", height)
+        else:
+            fullimage = self.stackimages([botface]*numtiles, "RGBA", height)
 
         self.faces[rtl.UP]  = self.leftskew(fullimage)
-        self.faces[rtl.RIGHT] = self.rightskew(ImageOps.mirror(fullimage))
-        self.masks[rtl.UP]  = self.leftskew(fullmask)
-        self.masks[rtl.RIGHT] = self.rightskew(ImageOps.mirror(fullmask))
+        self.faces[rtl.RIGHT] = self.mirrorskew(fullimage)
+
+        opaque = (botmask is OPAQUEMASK and midmask is OPAQUEMASK
+            and topmask is OPAQUEMASK)
+        if opaque and height in self.opaquemasks:
+            (self.masks[rtl.UP], self.masks[rtl.RIGHT]) = \
+                self.opaquemasks[height]
+        else:
+            if numtiles > 1:
+                fullmask = self.stackimages(
+                    [topmask] + [midmask]*(numtiles-2) + [botmask], "L", height)
+            else:
+                fullmask = self.stackimages([botmask]*numtiles, "L", height)
+            self.masks[rtl.UP]  = self.leftskew(fullmask, Image.NEAREST)
+            self.masks[rtl.RIGHT] = self.mirrorskew(fullmask, Image.NEAREST)
+            if opaque:
+                self.opaquemasks[height] = (self.masks[rtl.UP],
+                    self.masks[rtl.RIGHT])
 
         if self.floorimage != None:
-            self.floor = self.floortrans(self.floorimage)
+            self.floor = self.floortrans(self.convertimage(self.floorimage))
 
     def issolid(self, infoval):
         """ Checks if this tile type is a solid wall according to the
@@ -382,6 +628,8 @@ class thintile(walltile):
 
 
 class floortile(tile):
+    __slots__ = ("floor",)
+
     def generate_isometric(self, height):
         """ Generates an isometric set of four images for the floor,
         each of which takes up one block of map space."""
@@ -416,13 +664,30 @@ class variabletile(thintile):
     masks -- a two-dimensional list of two masks for the face images,
              for each special value.
     """
+    __slots__ = ("hybridmasks",)
+
+    def __init__(self, faceimages, facemasks, sideimages,
+            floorimage=None, viewheightoverride=-1):
+        """ Initializes as per the thintile class, additionally sorting
+        the face images and masks into their positions in a hybrid stack.
+        """
+        super(variabletile, self).__init__(faceimages, facemasks,
+            sideimages, floorimage, viewheightoverride)
+        self.hybridmasks = self.categorizehybrid(self.facemasks)
+
+    @property
+    def hybridfaces(self):
+        """ The face images for this tile, converted to RGBA on first
+        access and sorted as per categorizehybrid.
+        """
+        return self.categorizehybrid(self.faceimages)
 
     def issolid(self, infoval):
         """ Checks if this tile type is a solid wall according to the
         given info value. True unless special height info values turn
         this wall into a thin wall.
         """
-        return infoval not in self.specialheights
+        return not self.isspecial(infoval)
 
     @staticmethod
     def categorizehybrid(images):
@@ -458,6 +723,21 @@ class variabletile(thintile):
         botimg = images[0]
         return (botimg, botshort, midimg, midend, topimg, topend)
 
+    # Which piece of the hybrid stack (as per categorizehybrid) to place
+    # for each info value, at the floor-level, middle and ceiling
+    # positions of the stack. Keyed by the number of stack positions,
+    # where 3 covers any stack of 3 or more.
+    hybridplans = {
+        2: (((4, TOPEND), (7, TOPEND), (8, TOPEND)),
+            (),
+            ((5, BOTSHORT), (6, BOTSHORT), (9, BOTSHORT), (1, BOTSHORT))),
+        3: (((4, TOPEND), (6, TOPEND), (7, MIDIMG), (8, TOPIMG),
+                (9, TOPIMG), (1, TOPIMG)),
+            ((1, MIDIMG), (7, MIDIMG), (8, MIDIMG), (9, MIDIMG)),
+            ((5, BOTSHORT), (6, BOTSHORT), (7, MIDEND), (8, MIDEND),
+                (9, BOTIMG), (1, BOTIMG))),
+    }
+
     def generate_isometric(self, height):
         """ Generates isometric views for this tile at the specified
         map height. Creates skewed wall images facing in each direction,
@@ -467,428 +747,372 @@ class variabletile(thintile):
         """
         super(variabletile, self).generate_isometric(height)
 
-        # Redo faces for all possible info combinations
+        # Redo faces for all possible info combinations. Each stack is
+        # first built up as a list of images, one per position.
+        hybridfaces = self.hybridfaces
+        numtiles = height//64
         fullimage = [None]*10
         fullmask = [None]*10
 
         for i in self.specialheights:
-            fullimage[i] = Image.new("RGBA", (64, height))
-            fullmask[i] = Image.new("L", (64, height))
-
-        (botimg, botshort, midimg, midend, topimg, topend) = \
-            self.categorizehybrid(self.faceimages)
-        (botmask, botshortmask, midmask, midendmask, topmask, topendmask) = \
-            self.categorizehybrid(self.facemasks)
-
-        numtiles = height//64
-
-        for pos in range(numtiles):
-            if numtiles == 1:
-                # Single-height maps. Just fill all possibilties with a
-                # solid middle panel. No instances of this have been
-                # observed in the game.
-                for i in self.specialheights:
-                    fullimage[i].paste(midimg, (0, pos*64))
-                    fullmask[i].paste(midmask, (0, pos*64))
-            elif pos==0:
-                # Floor-level position
-                fullimage[4].paste(topend, (0, pos*64))
-                fullmask[4].paste(topendmask, (0, pos*64))
-
-                if numtiles == 2:
-                    fullimage[7].paste(topend, (0, pos*64))
-                    fullmask[7].paste(topendmask, (0, pos*64))
-                    fullimage[8].paste(topend, (0, pos*64))
-                    fullmask[8].paste(topendmask, (0, pos*64))
-                else:
-                    fullimage[6].paste(topend, (0, pos*64))
-                    fullmask[6].paste(topendmask, (0, pos*64))
-                    fullimage[7].paste(midimg, (0, pos*64))
-                    fullmask[7].paste(midmask, (0, pos*64))
-                    fullimage[8].paste(topimg, (0, pos*64))
-                    fullmask[8].paste(topmask, (0, pos*64))
-                    fullimage[9].paste(topimg, (0, pos*64))
-                    fullmask[9].paste(topmask, (0, pos*64))
-                    fullimage[1].paste(topimg, (0, pos*64))
-                    fullmask[1].paste(topmask, (0, pos*64))
-            elif pos == numtiles - 1:
-                # Ceiling position
-                fullimage[5].paste(botshort, (0, pos*64))
-                fullmask[5].paste(botshortmask, (0, pos*64))
-                fullimage[6].paste(botshort, (0, pos*64))
-                fullmask[6].paste(botshortmask, (0, pos*64))
-                if numtiles == 2:
-                    fullimage[9].paste(botshort, (0, pos*64))
-                    fullmask[9].paste(botshortmask, (0, pos*64))
-                    fullimage[1].paste(botshort, (0, pos*64))
-                    fullmask[1].paste(botshortmask, (0, pos*64))
+            fullimage[i] = [None]*numtiles
+            fullmask[i] = [None]*numtiles
+
+        if numtiles == 1:
+            # Single-height maps. Just fill all possibilties with a
+            # solid middle panel. No instances of this have been
+            # observed in the game.
+            for i in self.specialheights:
+                fullimage[i][0] = hybridfaces[MIDIMG]
+                fullmask[i][0] = self.hybridmasks[MIDIMG]
+        elif numtiles > 1:
+            (floorplan, middleplan, ceilingplan) = \
+                self.hybridplans[min(numtiles, 3)]
+            for pos in range(numtiles):
+                if pos == 0:
+                    plan = floorplan
+                elif pos == numtiles - 1:
+                    plan = ceilingplan
                 else:
-                    fullimage[7].paste(midend, (0, pos*64))
-                    fullmask[7].paste(midendmask, (0, pos*64))
-                    fullimage[8].paste(midend, (0, pos*64))
-                    fullmask[8].paste(midendmask, (0, pos*64))
-                    fullimage[9].paste(botimg, (0, pos*64))
-                    fullmask[9].paste(botmask, (0, pos*64))
-                    fullimage[1].paste(botimg, (0, pos*64))
-                    fullmask[1].paste(botmask, (0, pos*64))
-
-            else:
-                # Every position between floor and ceiling
-                for i in [1] + list(range(7,10)):
-                    fullimage[i].paste(midimg, (0, pos*64))
-                    fullmask[i].paste(midmask, (0, pos*64))
+                    plan = middleplan
 
-        self.faces = [[None]*10,[None]*10]
-        self.masks = [[None]*10,[None]*10]
+                for (i, piece) in plan:
+                    fullimage[i][pos] = hybridfaces[piece]
+                    fullmask[i][pos] = self.hybridmasks[piece]
 
         for i in self.specialheights:
-            self.faces[rtl.UP][i]    = self.leftskew(fullimage[i])
-            self.faces[rtl.RIGHT][i] = self.rightskew(fullimage[i])
-            self.masks[rtl.UP][i]    = self.leftskew(fullmask[i])
-            self.masks[rtl.RIGHT][i] = self.rightskew(fullmask[i])
+            fullimage[i] = self.stackimages(fullimage[i], "RGBA", height)
+            fullmask[i] = self.stackimages(fullmask[i], "L", height)
+
+        # Each orientation's list of faces is built in a single pass.
+        # Info values without a stack are left as None.
+        self.faces = [None]*2
+        self.masks = [None]*2
+
+        self.faces[rtl.UP] = [None if image == None
+            else self.leftskew(image) for image in fullimage]
+        self.faces[rtl.RIGHT] = [None if image == None
+            else self.rightskew(image) for image in fullimage]
+        self.masks[rtl.UP] = [None if mask == None
+            else self.leftskew(mask, Image.NEAREST) for mask in fullmask]
+        self.masks[rtl.RIGHT] = [None if mask == None
+            else self.rightskew(mask, Image.NEAREST) for mask in fullmask]
 
     def isthin(self, infoval):
         """ Checks if this tile type is a thin wall according to the
         given info value. False unless special height info values turn
         this wall into a thin wall.
         """
-        return infoval in self.specialheights
+        return self.isspecial(infoval)
 
 class walldb:
     """ Database of all known index to floor/wall tile mappings.
 
     Public member variables:
-    tiles -- an array of floor/wall tiles, indexed by the wall id. Each
-             position will contain a corresponding tile object.
+    tiles -- a dictionary of floor/wall tiles, keyed by the wall id.
+             Every id from 0 to 255 maps to a corresponding tile object;
+             unknown ids map to debug walls.
     """
 
+    # Ranges of standard wall ids, as (first id, last id, WAD section,
+    # index of the first lump in that section).
+    wallranges = [
+        (1, 32, "WALL", 0),
+        (36, 45, "WALL", 32),
+        (46, 46, "WALL", 73),
+        (49, 71, "WALL", 40),
+        (72, 75, "ELEV", 0),
+        (80, 89, "WALL", 63)]
+
+    # Walls with WALL22 as the texture above them, as (id, WAD section,
+    # index of the lump in that section).
+    abovewalls = [
+        (11, "WALL", 10),
+        (47, "EXIT", 0),
+        (48, "EXIT", 1),
+        (76, "ELEV", 4),
+        (77, "ELEV", 5),
+        (78, "ELEV", 6),
+        (79, "ELEV", 7)]
+
+    # Doors, as (id, DOOR lump name, index of the ABVW lump above the
+    # door, SIDE lump name for the side walls).
+    # TODO: Duplicates? (90/98, 91/99, 92/93/103 and 100/101/104 are
+    # identical here and share one tile)
+    doors = [
+        (90, "RAMDOOR1", 0, "SIDE8"),
+        (98, "RAMDOOR1", 0, "SIDE8"),
+        (91, "DOOR2", 0, "SIDE8"),
+        (99, "DOOR2", 0, "SIDE8"),
+        (92, "TRIDOOR1", 0, "SIDE8"),
+        (93, "TRIDOOR1", 0, "SIDE8"),
+        (103, "TRIDOOR1", 0, "SIDE8"),
+        (100, "SDOOR4", 0, "SIDE8"),
+        (101, "SDOOR4", 0, "SIDE8"),
+        (104, "SDOOR4", 0, "SIDE8"),
+        (94, "SDOOR4", 0, "LOCK1"), # Explicitly Locked with Gold Key
+        (95, "SDOOR4", 0, "LOCK2"), # Explicitly Locked with Silver Key
+        (96, "SDOOR4", 0, "LOCK3"), # Explicitly Locked with Iron Key
+        (97, "SDOOR4", 0, "LOCK4"), # Explicitly Locked with Obscuro Key
+        (102, "EDOOR", 0, "SIDE8"),
+        # Multi-part Door 1
+        (33, "SNDOOR", 1, "SIDE16"),
+        (34, "SNADOOR", 1, "SIDE16"),
+        (35, "SNKDOOR", 1, "SIDE16"),
+        # Multi-part Door 2
+        (154, "TNDOOR", 2, "SIDE17"),
+        (155, "TNADOOR", 2, "SIDE17"),
+        (156, "TNKDOOR", 2, "SIDE17")]
+
+    # Masked thin walls, as (id, list of (WAD section, lump) for the
+    # face images from the bottom up, SIDE lump name for the side walls
+    # or None). Lumps are given by name, or by index within the section.
+    # A None layer is left empty.
+    maskedwalls = [
+        # Fence
+        (179, [("MASK", "RAILING"), None], None),
+        # Multi-part Window
+        (158, [("MASK", "MULTI1"), ("ABVM", "ABOVEM5A"), ("ABVM", "ABOVEM5")],
+            "SIDE21"),
+        (159, [("MASK", "MULTI2"), ("ABVM", "ABOVEM5B"), ("ABVM", "ABOVEM5")],
+            "SIDE21"),
+        (160, [("MASK", "MULTI3"), ("ABVM", "ABOVEM5C"), ("ABVM", "ABOVEM5")],
+            "SIDE21"),
+        # Individual Windows
+        (162, [("MASK", "MASKED1"), ("ABVM", "ABOVEM4A"), ("ABVM", "ABOVEM4")],
+            "SIDE21"),
+        (163, [("MASK", "MASKED1A"), ("ABVM", "ABOVEM4A"), ("ABVM", "ABOVEM4")],
+            "SIDE21"),
+        (164, [("MASK", "MASKED2"), ("ABVM", "ABOVEM4A"), ("ABVM", "ABOVEM4")],
+            "SIDE21"),
+        (165, [("MASK", "MASKED2A"), ("ABVM", "ABOVEM4A"), ("ABVM", "ABOVEM4")],
+            "SIDE21"),
+        (166, [("MASK", "MASKED3"), ("ABVM", "ABOVEM4A"), ("ABVM", "ABOVEM4")],
+            "SIDE21"),
+        (167, [("MASK", "MASKED3A"), ("ABVM", "ABOVEM4A"), ("ABVM", "ABOVEM4")],
+            "SIDE21"),
+        (168, [("MASK", "MASKED4"), ("ABVM", "ABOVEM4A"), ("ABVM", "ABOVEM4")],
+            "SIDE21"),
+        (170, [("MASK", "DOGMASK"), ("ABVM", "ABOVEM9"), ("ABVM", "ABOVEM4")],
+            "SIDE21"),
+        (171, [("MASK", "PEEPMASK"), ("ABVM", "ABOVEM4A"), ("ABVM", "ABOVEM4")],
+            "SIDE21"),
+        # Switches
+        (157, [("HMSK", "HSWITCH1"), ("HMSK", "HSWITCH2"), ("HMSK", "HSWITCH3")],
+            None),
+        (175, [("HMSK", "HSWITCH1"), ("HMSK", "HSWITCH2"), ("HMSK", "HSWITCH3")],
+            None),
+        # Exit Tiles
+        (172, [("EXIT", 2), ("ABVM", "ABOVEM4A"), ("ABVM", "ABOVEM4")],
+            "SIDE21"),
+        (173, [("EXIT", 3), ("ABVM", "ABOVEM4A"), ("ABVM", "ABOVEM4")],
+            "SIDE21"),
+        (174, [("EXIT", 4), ("ABVM", "ABOVEM4A"), ("ABVM", "ABOVEM4")],
+            "SIDE21")]
+
+    # View height overrides for thin walls which do not obscure
+    # anything behind them, keyed by id.
+    viewheights = {179: 48}
+
+    # Animating Tiles, as (id, ANIM lump name)
+    # List from RT_STAT.C line 194
+    # Mapping from RT_TED.C line 2124
+    animwalls = [
+        (44, "FPLACE1"),
+        (45, "ANIMFAC1"),
+        (106, "ANIMY1"),
+        (107, "ANIMR1"),
+        (224, "ANIMONE1"),
+        (225, "ANIMTWO1"),
+        (226, "ANIMTHR1"),
+        (227, "ANIMFOR1"),
+        (228, "ANIMBW1"),
+        (229, "ANIMYOU1"),
+        (230, "ANIMBW1"),
+        (231, "ANIMBP1"),
+        (232, "ANIMBP1"),
+        (233, "ANIMFW1"),
+        (242, "ANIMLAT1"),
+        (243, "ANIMST1"),
+        (244, "ANIMRP1")]
+
+    # Lumps already looked up for a given WAD file instance, keyed by
+    # (section, lump name or index). Lumps are read-only, so these are
+    # shared by every database built from the same WAD.
+    lumpcache = weakref.WeakKeyDictionary()
+
     def __init__(self, WAD, floorindex):
         """ Populates the index to wall mappings in the wall
         database using the wall/floor/mask images found in the provided
         WAD file instance.
 
+        Every database has its own tile objects, so databases generated
+        at different heights keep their own isometric views. Only the
+        read-only inputs are shared between databases: the WAD lumps
+        looked up for the tiles (per WAD file), and the RGBA, floor and
+        darkened versions of their images (see the tile class caches).
+
         WAD -- wad file instance to read image data from
         floorindex -- index number of floor tile to use
         """
-        self.tiles = [None] * 256
+        self.tiles = {}
         self.tiles[0] = emptytile(None)
 
-        # Initialize with debug walls:
-        for i in range(1,256):
-            self.tiles[i] = walltile([Image.new("RGBA", (64, 64), (128,128,128))])
-            self.tiles[i].setdebug(i)
-
-        # Fill in floors
+        # Fill in floors. Every floor id draws the same floor image, so
+        # they all share a single floor tile.
         floorimage = WAD.db["UPDN"]["FLRCL{}".format(floorindex)].data
+        floor = floortile([floorimage])
         for i in range(108,153):
-            self.tiles[i] = floortile([floorimage])
+            self.tiles[i] = floor
+
+        # Every thin wall draws the same floor underneath
+        thinwall = functools.partial(thintile, floorimage=floorimage)
 
         # Copy in Wall array (algorithm from ROTT source code)
-        for tile in range(90):
-            if tile >= 1 and tile <= 32:
-                self.tiles[tile] = walltile([WAD.data["WALL"][tile-1].data])
-            elif tile >= 36 and tile <= 45:
-                self.tiles[tile] = walltile([WAD.data["WALL"][tile-4].data])
-            elif tile == 46:
-                self.tiles[tile] = walltile([WAD.data["WALL"][73].data])
-            elif tile >= 47 and tile <= 48:
-                self.tiles[tile] = walltile([WAD.data["EXIT"][tile-47].data,
-                    WAD.data["WALL"][21].data])
-            elif tile >= 49 and tile <= 71:
-                self.tiles[tile] = walltile([WAD.data["WALL"][tile-9].data])
-            elif tile >= 72 and tile <= 79:
-                self.tiles[tile] = walltile([WAD.data["ELEV"][tile-72].data])
-            elif tile >= 80 and tile <= 89:
-                self.tiles[tile] = walltile([WAD.data["WALL"][tile-17].data])
+        for (first, last, section, index) in self.wallranges:
+            sectionlumps = WAD.data[section]
+            for i in range(first, last+1):
+                self.tiles[i] = walltile(
+                    [sectionlumps[index+i-first].data])
 
         # Special walls (i.e. different above texture)
-        self.tiles[11] = walltile([WAD.data["WALL"][10].data,
-            WAD.data["WALL"][21].data])
-        self.tiles[76] = walltile([WAD.data["ELEV"][4].data,
-            WAD.data["WALL"][21].data])
-        self.tiles[77] = walltile([WAD.data["ELEV"][5].data,
-            WAD.data["WALL"][21].data])
-        self.tiles[78] = walltile([WAD.data["ELEV"][6].data,
-            WAD.data["WALL"][21].data])
-        self.tiles[79] = walltile([WAD.data["ELEV"][7].data,
-            WAD.data["WALL"][21].data])
+        walls = WAD.data["WALL"]
+        aboveimage = walls[21].data
+        for (i, section, index) in self.abovewalls:
+            self.tiles[i] = walltile([WAD.data[section][index].data,
+                aboveimage])
 
+        hmsk = WAD.data["HMSK"]
         self.tiles[21] = variabletile(
-            [WAD.data["HMSK"][14].data], [WAD.data["HMSK"][14].mask],
-            [WAD.data["WALL"][20].data], floorimage)
+            [hmsk[14].data], [hmsk[14].mask],
+            [walls[20].data], floorimage)
+        spacerlumps = [hmsk[i] for i in (4, 8, 12, 7, 5, 10)]
         self.spacer = variabletile(
-            [WAD.data["HMSK"][4].data,
-            WAD.data["HMSK"][8].data,
-            WAD.data["HMSK"][12].data,
-            WAD.data["HMSK"][7].data,
-            WAD.data["HMSK"][5].data,
-            WAD.data["HMSK"][10].data],
-            [WAD.data["HMSK"][4].mask,
-            WAD.data["HMSK"][8].mask,
-            WAD.data["HMSK"][12].mask,
-            WAD.data["HMSK"][7].mask,
-            WAD.data["HMSK"][5].mask,
-            WAD.data["HMSK"][10].mask],
-            [WAD.data["HMSK"][7].data],
-            floorimage)
-
-        # Assign known DOORs:
-        # TODO: Duplicates?
-        self.tiles[90] = thintile(
-            [WAD.db["DOOR"]["RAMDOOR1"].data, WAD.data["ABVW"][0].data],
-            [None, None],
-            [WAD.db["SIDE"]["SIDE8"].data],
-            floorimage)
-        self.tiles[98] = thintile(
-            [WAD.db["DOOR"]["RAMDOOR1"].data, WAD.data["ABVW"][0].data],
-            [None, None],
-            [WAD.db["SIDE"]["SIDE8"].data],
-            floorimage)
-
-
-        # TODO: Duplicates?
-        self.tiles[91] = thintile(
-            [WAD.db["DOOR"]["DOOR2"].data, WAD.data["ABVW"][0].data],
-            [None, None],
-            [WAD.db["SIDE"]["SIDE8"].data],
-            floorimage)
-        self.tiles[99] = thintile(
-            [WAD.db["DOOR"]["DOOR2"].data, WAD.data["ABVW"][0].data],
-            [None, None],
-            [WAD.db["SIDE"]["SIDE8"].data],
-            floorimage)
-
-        # TODO: Duplicates?
-        self.tiles[92] = thintile(
-            [WAD.db["DOOR"]["TRIDOOR1"].data, WAD.data["ABVW"][0].data],
-            [None, None],
-            [WAD.db["SIDE"]["SIDE8"].data],
-            floorimage)
-        self.tiles[93] = thintile(
-            [WAD.db["DOOR"]["TRIDOOR1"].data, WAD.data["ABVW"][0].data],
-            [None, None],
-            [WAD.db["SIDE"]["SIDE8"].data],
-            floorimage)
-        self.tiles[103] = thintile(
-            [WAD.db["DOOR"]["TRIDOOR1"].data, WAD.data["ABVW"][0].data],
-            [None, None],
-            [WAD.db["SIDE"]["SIDE8"].data],
-            floorimage)
-
-        # TODO: Duplicates?
-        self.tiles[100] = thintile(
-            [WAD.db["DOOR"]["SDOOR4"].data, WAD.data["ABVW"][0].data],
-            [None, None],
-            [WAD.db["SIDE"]["SIDE8"].data],
-            floorimage)
-        self.tiles[101] = thintile(
-            [WAD.db["DOOR"]["SDOOR4"].data, WAD.data["ABVW"][0].data],
-            [None, None],
-            [WAD.db["SIDE"]["SIDE8"].data],
-            floorimage)
-        self.tiles[104] = thintile(
-            [WAD.db["DOOR"]["SDOOR4"].data, WAD.data["ABVW"][0].data],
-            [None, None],
-            [WAD.db["SIDE"]["SIDE8"].data],
+            [lump.data for lump in spacerlumps],
+            [lump.mask for lump in spacerlumps],
+            [hmsk[7].data],
             floorimage)
 
-        # Explicitly Locked with Gold Key
-        self.tiles[94] = thintile(
-            [WAD.db["DOOR"]["SDOOR4"].data, WAD.data["ABVW"][0].data],
-            [None, None],
-            [WAD.db["SIDE"]["LOCK1"].data],
-            floorimage)
-
-        # Explicitly Locked with Silver Key
-        self.tiles[95] = thintile(
-            [WAD.db["DOOR"]["SDOOR4"].data, WAD.data["ABVW"][0].data],
-            [None, None],
-            [WAD.db["SIDE"]["LOCK2"].data],
-            floorimage)
-
-        # Explicitly Locked with Iron Key
-        self.tiles[96] = thintile(
-            [WAD.db["DOOR"]["SDOOR4"].data, WAD.data["ABVW"][0].data],
-            [None, None],
-            [WAD.db["SIDE"]["LOCK3"].data],
-            floorimage)
-
-        # Explicitly Locked with Obscuro Key
-        self.tiles[97] = thintile(
-            [WAD.db["DOOR"]["SDOOR4"].data, WAD.data["ABVW"][0].data],
-            [None, None],
-            [WAD.db["SIDE"]["LOCK4"].data],
-            floorimage)
-
-
-        self.tiles[102] = thintile(
-            [WAD.db["DOOR"]["EDOOR"].data, WAD.data["ABVW"][0].data],
-            [None, None],
-            [WAD.db["SIDE"]["SIDE8"].data],
-            floorimage)
-
-
-        # Multi-part Door 1
-        self.tiles[33] = thintile(
-            [WAD.db["DOOR"]["SNDOOR"].data, WAD.data["ABVW"][1].data],
-            [None, None],
-            [WAD.db["SIDE"]["SIDE16"].data],
-            floorimage)
-        self.tiles[34] = thintile(
-            [WAD.db["DOOR"]["SNADOOR"].data, WAD.data["ABVW"][1].data],
-            [None, None],
-            [WAD.db["SIDE"]["SIDE16"].data],
-            floorimage)
-        self.tiles[35] = thintile(
-            [WAD.db["DOOR"]["SNKDOOR"].data, WAD.data["ABVW"][1].data],
-            [None, None],
-            [WAD.db["SIDE"]["SIDE16"].data],
-            floorimage)
+        # Lumps used by more than one tile, or by more than one database
+        # for this WAD, are only looked up once
+        lumps = self.lumpcache.setdefault(WAD, {})
+        def lookup(section, name):
+            """ Looks up a lump in the given WAD section, either by name
+            or by its index within the section.
+            """
+            if (section, name) not in lumps:
+                if type(name) is int:
+                    lumps[(section, name)] = WAD.data[section][name]
+                else:
+                    lumps[(section, name)] = WAD.db[section][name]
+            return lumps[(section, name)]
+
+        # Thin walls with the same side walls share their isometric wall
+        # views, keyed by side lump name
+        sidetiles = {}
+        def sidewalls(name):
+            """ Returns the side images and tile to share side walls with
+            for the given SIDE lump name (which may be None).
+            """
+            if name == None:
+                return (None, None)
+            return ([lookup("SIDE", name).data], sidetiles.get(name))
+
+        # Tiles built from identical lumps (e.g. the duplicate doors, the
+        # two switches) are the same tile object, so their isometric
+        # views are only generated once. Keyed by table entry.
+        built = {}
 
-        # Multi-part Door 2
-        self.tiles[154] = thintile(
-            [WAD.db["DOOR"]["TNDOOR"].data, WAD.data["ABVW"][2].data],
-            [None, None],
-            [WAD.db["SIDE"]["SIDE17"].data],
-            floorimage)
-        self.tiles[155] = thintile(
-            [WAD.db["DOOR"]["TNADOOR"].data, WAD.data["ABVW"][2].data],
-            [None, None],
-            [WAD.db["SIDE"]["SIDE17"].data],
-            floorimage)
-        self.tiles[156] = thintile(
-            [WAD.db["DOOR"]["TNKDOOR"].data, WAD.data["ABVW"][2].data],
-            [None, None],
-            [WAD.db["SIDE"]["SIDE17"].data],
-            floorimage)
+        # Assign known DOORs:
+        for (i, doorname, aboveindex, sidename) in self.doors:
+            key = ("DOOR", doorname, aboveindex, sidename)
+            if key not in built:
+                (sideimages, sharedwalls) = sidewalls(sidename)
+                built[key] = thinwall(
+                    [lookup("DOOR", doorname).data,
+                        lookup("ABVW", aboveindex).data],
+                    [None, None],
+                    sideimages, sharedwalls=sharedwalls)
+                sidetiles.setdefault(sidename, built[key])
+            self.tiles[i] = built[key]
 
         # Fences, Windows, Switches, etc:
-        # Multi-part Window
-        self.tiles[158] = thintile(
-            [WAD.db["MASK"]["MULTI1"].data, WAD.db["ABVM"]["ABOVEM5A"].data, WAD.db["ABVM"]["ABOVEM5"].data],
-            [WAD.db["MASK"]["MULTI1"].mask, WAD.db["ABVM"]["ABOVEM5A"].mask, WAD.db["ABVM"]["ABOVEM5"].mask],
-            [WAD.db["SIDE"]["SIDE21"].data],
-            floorimage)
-        self.tiles[159] = thintile(
-            [WAD.db["MASK"]["MULTI2"].data, WAD.db["ABVM"]["ABOVEM5B"].data, WAD.db["ABVM"]["ABOVEM5"].data],
-            [WAD.db["MASK"]["MULTI2"].mask, WAD.db["ABVM"]["ABOVEM5B"].mask, WAD.db["ABVM"]["ABOVEM5"].mask],
-            [WAD.db["SIDE"]["SIDE21"].data],
-            floorimage)
-        self.tiles[160] = thintile(
-            [WAD.db["MASK"]["MULTI3"].data, WAD.db["ABVM"]["ABOVEM5C"].data, WAD.db["ABVM"]["ABOVEM5"].data],
-            [WAD.db["MASK"]["MULTI3"].mask, WAD.db["ABVM"]["ABOVEM5C"].mask, WAD.db["ABVM"]["ABOVEM5"].mask],
-            [WAD.db["SIDE"]["SIDE21"].data],
-            floorimage)
-
-        # Individual Windows
-        self.tiles[162] = thintile(
-            [WAD.db["MASK"]["MASKED1"].data, WAD.db["ABVM"]["ABOVEM4A"].data, WAD.db["ABVM"]["ABOVEM4"].data],
-            [WAD.db["MASK"]["MASKED1"].mask, WAD.db["ABVM"]["ABOVEM4A"].mask, WAD.db["ABVM"]["ABOVEM4"].mask],
-            [WAD.db["SIDE"]["SIDE21"].data],
-            floorimage)
-        self.tiles[163] = thintile(
-            [WAD.db["MASK"]["MASKED1A"].data, WAD.db["ABVM"]["ABOVEM4A"].data, WAD.db["ABVM"]["ABOVEM4"].data],
-            [WAD.db["MASK"]["MASKED1A"].mask, WAD.db["ABVM"]["ABOVEM4A"].mask, WAD.db["ABVM"]["ABOVEM4"].mask],
-            [WAD.db["SIDE"]["SIDE21"].data],
-            floorimage)
-        self.tiles[164] = thintile(
-            [WAD.db["MASK"]["MASKED2"].data, WAD.db["ABVM"]["ABOVEM4A"].data, WAD.db["ABVM"]["ABOVEM4"].data],
-            [WAD.db["MASK"]["MASKED2"].mask, WAD.db["ABVM"]["ABOVEM4A"].mask, WAD.db["ABVM"]["ABOVEM4"].mask],
-            [WAD.db["SIDE"]["SIDE21"].data],
-            floorimage)
-        self.tiles[165] = thintile(
-            [WAD.db["MASK"]["MASKED2A"].data, WAD.db["ABVM"]["ABOVEM4A"].data, WAD.db["ABVM"]["ABOVEM4"].data],
-            [WAD.db["MASK"]["MASKED2A"].mask, WAD.db["ABVM"]["ABOVEM4A"].mask, WAD.db["ABVM"]["ABOVEM4"].mask],
-            [WAD.db["SIDE"]["SIDE21"].data],
-            floorimage)
-        self.tiles[166] = thintile(
-            [WAD.db["MASK"]["MASKED3"].data, WAD.db["ABVM"]["ABOVEM4A"].data, WAD.db["ABVM"]["ABOVEM4"].data],
-            [WAD.db["MASK"]["MASKED3"].mask, WAD.db["ABVM"]["ABOVEM4A"].mask, WAD.db["ABVM"]["ABOVEM4"].mask],
-            [WAD.db["SIDE"]["SIDE21"].data],
-            floorimage)
-        self.tiles[167] = thintile(
-            [WAD.db["MASK"]["MASKED3A"].data, WAD.db["ABVM"]["ABOVEM4A"].data, WAD.db["ABVM"]["ABOVEM4"].data],
-            [WAD.db["MASK"]["MASKED3A"].mask, WAD.db["ABVM"]["ABOVEM4A"].mask, WAD.db["ABVM"]["ABOVEM4"].mask],
-            [WAD.db["SIDE"]["SIDE21"].data],
-            floorimage)
-        self.tiles[168] = thintile(
-            [WAD.db["MASK"]["MASKED4"].data, WAD.db["ABVM"]["ABOVEM4A"].data, WAD.db["ABVM"]["ABOVEM4"].data],
-            [WAD.db["MASK"]["MASKED4"].mask, WAD.db["ABVM"]["ABOVEM4A"].mask, WAD.db["ABVM"]["ABOVEM4"].mask],
-            [WAD.db["SIDE"]["SIDE21"].data],
-            floorimage)
-        self.tiles[170] = thintile(
-            [WAD.db["MASK"]["DOGMASK"].data, WAD.db["ABVM"]["ABOVEM9"].data, WAD.db["ABVM"]["ABOVEM4"].data],
-            [WAD.db["MASK"]["DOGMASK"].mask, WAD.db["ABVM"]["ABOVEM9"].mask, WAD.db["ABVM"]["ABOVEM4"].mask],
-            [WAD.db["SIDE"]["SIDE21"].data],
-            floorimage)
-        self.tiles[171] = thintile(
-            [WAD.db["MASK"]["PEEPMASK"].data, WAD.db["ABVM"]["ABOVEM4A"].data, WAD.db["ABVM"]["ABOVEM4"].data],
-            [WAD.db["MASK"]["PEEPMASK"].mask, WAD.db["ABVM"]["ABOVEM4A"].mask, WAD.db["ABVM"]["ABOVEM4"].mask],
-            [WAD.db["SIDE"]["SIDE21"].data],
-            floorimage)
-
-        # Fence
-        self.tiles[179] = thintile(
-            [WAD.db["MASK"]["RAILING"].data, Image.new("L", (64, 64), 0)],
-            [WAD.db["MASK"]["RAILING"].mask, Image.new("L", (64, 64), 0)],
-            None, floorimage, viewheightoverride=48)
-
-        # Switches
-        self.tiles[157] = thintile(
-            [WAD.db["HMSK"]["HSWITCH1"].data, WAD.db["HMSK"]["HSWITCH2"].data, WAD.db["HMSK"]["HSWITCH3"].data],
-            [WAD.db["HMSK"]["HSWITCH1"].mask, WAD.db["HMSK"]["HSWITCH2"].mask, WAD.db["HMSK"]["HSWITCH3"].mask],
-            None, floorimage)
-        self.tiles[175] = thintile(
-            [WAD.db["HMSK"]["HSWITCH1"].data, WAD.db["HMSK"]["HSWITCH2"].data, WAD.db["HMSK"]["HSWITCH3"].data],
-            [WAD.db["HMSK"]["HSWITCH1"].mask, WAD.db["HMSK"]["HSWITCH2"].mask, WAD.db["HMSK"]["HSWITCH3"].mask],
-            None, floorimage)
-
-        # Exit Tiles
-        self.tiles[172] = thintile(
-            [WAD.data["EXIT"][2].data, WAD.db["ABVM"]["ABOVEM4A"].data, WAD.db["ABVM"]["ABOVEM4"].data],
-            [WAD.data["EXIT"][2].mask, WAD.db["ABVM"]["ABOVEM4A"].mask, WAD.db["ABVM"]["ABOVEM4"].mask],
-            [WAD.db["SIDE"]["SIDE21"].data],
-            floorimage)
-        self.tiles[173] = thintile(
-            [WAD.data["EXIT"][3].data, WAD.db["ABVM"]["ABOVEM4A"].data, WAD.db["ABVM"]["ABOVEM4"].data],
-            [WAD.data["EXIT"][3].mask, WAD.db["ABVM"]["ABOVEM4A"].mask, WAD.db["ABVM"]["ABOVEM4"].mask],
-            [WAD.db["SIDE"]["SIDE21"].data],
-            floorimage)
-        self.tiles[174] = thintile(
-            [WAD.data["EXIT"][4].data, WAD.db["ABVM"]["ABOVEM4A"].data, WAD.db["ABVM"]["ABOVEM4"].data],
-            [WAD.data["EXIT"][4].mask, WAD.db["ABVM"]["ABOVEM4A"].mask, WAD.db["ABVM"]["ABOVEM4"].mask],
-            [WAD.db["SIDE"]["SIDE21"].data],
-            floorimage)
+        for (i, layers, sidename) in self.maskedwalls:
+            viewheight = self.viewheights.get(i, -1)
+            key = (tuple(layers), sidename, viewheight)
+            if key not in built:
+                (sideimages, sharedwalls) = sidewalls(sidename)
+                faces = []
+                masks = []
+                for layer in layers:
+                    if layer == None:
+                        faces.append(EMPTYIMAGE)
+                        masks.append(EMPTYIMAGE)
+                    else:
+                        faces.append(lookup(*layer).data)
+                        masks.append(lookup(*layer).mask)
+                built[key] = thinwall(faces, masks, sideimages,
+                    viewheightoverride=viewheight, sharedwalls=sharedwalls)
+                if sidename != None:
+                    sidetiles.setdefault(sidename, built[key])
+            self.tiles[i] = built[key]
 
         # Animating Tiles
-        # List from RT_STAT.C line 194
-        # Mapping from RT_TED.C line 2124
-        self.tiles[44] = walltile([WAD.db["ANIM"]["FPLACE1"].data])
-        self.tiles[45] = walltile([WAD.db["ANIM"]["ANIMFAC1"].data])
-
-        self.tiles[106] = walltile([WAD.db["ANIM"]["ANIMY1"].data])
-        self.tiles[107] = walltile([WAD.db["ANIM"]["ANIMR1"].data])
-
-        self.tiles[224] = walltile([WAD.db["ANIM"]["ANIMONE1"].data])
-        self.tiles[225] = walltile([WAD.db["ANIM"]["ANIMTWO1"].data])
-        self.tiles[226] = walltile([WAD.db["ANIM"]["ANIMTHR1"].data])
-        self.tiles[227] = walltile([WAD.db["ANIM"]["ANIMFOR1"].data])
-        self.tiles[228] = walltile([WAD.db["ANIM"]["ANIMBW1"].data])
-        self.tiles[229] = walltile([WAD.db["ANIM"]["ANIMYOU1"].data])
-        self.tiles[230] = walltile([WAD.db["ANIM"]["ANIMBW1"].data])
-        self.tiles[231] = walltile([WAD.db["ANIM"]["ANIMBP1"].data])
-        self.tiles[232] = walltile([WAD.db["ANIM"]["ANIMBP1"].data])
-        self.tiles[233] = walltile([WAD.db["ANIM"]["ANIMFW1"].data])
-
-        self.tiles[242] = walltile([WAD.db["ANIM"]["ANIMLAT1"].data])
-        self.tiles[243] = walltile([WAD.db["ANIM"]["ANIMST1"].data])
-        self.tiles[244] = walltile([WAD.db["ANIM"]["ANIMRP1"].data])
+        for (i, name) in self.animwalls:
+            key = ("ANIM", name)
+            if key not in built:
+                built[key] = walltile([lookup("ANIM", name).data])
+            self.tiles[i] = built[key]
+
+        # Fill any remaining ids with debug walls. These are all copies
+        # of a single gray wall, so its isometric views are only
+        # generated once:
+        debugwall = walltile([DEBUGIMAGE])
+        for i in range(1,256):
+            if i not in self.tiles:
+                self.tiles[i] = copy.copy(debugwall)
+                self.tiles[i].setdebug(i)
 
-    def generate_isometric(self, height):
-        """ Generates isometric images for every tile in this database
+    def generate_isometric(self, height, indices=None):
+        """ Generates isometric images for the tiles in this database
         at the given map height.
+
+        height -- map height to generate the isometric images for
+        indices -- if specified, a collection of the tile indices that
+                   are actually used (e.g. the set of values in a level's
+                   wall layer). Only those tiles and the spacer are
+                   generated; the rest are left untouched. Otherwise,
+                   every tile is generated.
+
+        Tiles are generated in parallel, since PIL releases the GIL
+        while transforming images. Tiles that share their isometric wall
+        views with another tile (i.e. the debug walls and thin walls with
+        the same sides) are held back until the first of them is done,
+        so the shared views are only generated once. Tiles that appear
+        under several indices are only generated once as well.
         """
-        for wall in self.tiles:
-            wall.generate_isometric(height)
-        self.spacer.generate_isometric(height)
+        first = []
+        rest = []
+        seen = set()
+        seencaches = set()
+        if indices == None:
+            walls = list(self.tiles.values()) + [self.spacer]
+        else:
+            walls = [self.tiles[i] for i in sorted(indices)] + [self.spacer]
+        for wall in walls:
+            if id(wall) in seen:
+                continue
+            seen.add(id(wall))
+            if id(wall.isocache) in seencaches:
+                rest.append(wall)
+            else:
+                seencaches.add(id(wall.isocache))
+                first.append(wall)
+
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            for batch in [first, rest]:
+                futures = [executor.submit(wall.generate_isometric, height)
+                    for wall in batch]
+                for future in futures:
+                    future.result()
 